@@ -1,182 +1,210 @@
 # -*- coding: utf-8 -*-
 import os
-import json
 import time
-from datetime import datetime, timezone
+
+_SCRIPT_STARTED = time.perf_counter()  # 起動時間の計測（StartupReport）の基準
+
+from functools import partial
 from urllib.parse import urlencode
 
-import requests
-import pandas as pd
+# pandas / requests / gspread / google-auth は使う機能で初めて読み込む（ログイン画面を早く出すため）
 import streamlit as st
 
-# =========================
-# Dify 設定
-# =========================
-DIFY_CHAT_URL = "https://api.dify.ai/v1/chat-messages"
-
-# ペルソナの表示名とSecretsのキーをマッピング
-PERSONA_NAMES = [
-    "①ミノンBC理想ファン_乳児ママ_本田ゆい（30）",
-    "②ミノンBC理想ファン_乳児パパ_安西涼太（31）",
-    "③ミノンBC理想ファン_保育園/幼稚園ママ_戸田綾香（35）",
-    "④ミノンBC理想ファン_更年期女性_高橋恵子（48）",
-    "⑤ミノンBC未満ファン_乳児ママ_中村優奈（31）",
-    "⑥ミノンBC未満ファン_乳児パパ_岡田健志（32）",
-    "⑦ミノンBC未満ファン_保育園・幼稚園ママ_石田真帆（34）",
-    "⑧ミノンBC未満ファン_更年期女性_杉山紀子（51）",
-]
-
-
-def get_persona_api_keys():
-    """SecretsからAPIキーを読み込む（トップレベル/ネスト両対応 & フォールバック）"""
-    keys = {}
-
-    # 1) まずはトップレベル（従来）
-    for i, name in enumerate(PERSONA_NAMES):
-        k = st.secrets.get(f"PERSONA_{i+1}_KEY")
-        if k:
-            keys[name] = k
-
-    # 2) 次に [persona_api_keys] テーブル
-    if "persona_api_keys" in st.secrets:
-        table = st.secrets["persona_api_keys"]
-        for i, name in enumerate(PERSONA_NAMES):
-            k = table.get(f"PERSONA_{i+1}_KEY")
-            if k and name not in keys:
-                keys[name] = k
-
-    # 3) 何も見つからない場合の汎用フォールバック（任意）
-    if not keys:
-        generic = st.secrets.get("DIFY_API_KEY")
-        if generic:
-            for name in PERSONA_NAMES:
-                keys[name] = generic
-
-    return keys
-
-PERSONA_API_KEYS = get_persona_api_keys()
-
-# アバター（ファイルが無い場合は絵文字にフォールバック）
-PERSONA_AVATARS = {
-    "①ミノンBC理想ファン_乳児ママ_本田ゆい（30）": "persona_1.jpg",
-    "②ミノンBC理想ファン_乳児パパ_安西涼太（31）": "persona_2.jpg",
-    "③ミノンBC理想ファン_保育園/幼稚園ママ_戸田綾香（35）": "persona_3.jpg",
-    "④ミノンBC理想ファン_更年期女性_高橋恵子（48）": "persona_4.jpg",
-    "⑤ミノンBC未満ファン_乳児ママ_中村優奈（31）": "persona_5.jpg",
-    "⑥ミノンBC未満ファン_乳児パパ_岡田健志（32）": "persona_6.jpg",
-    "⑦ミノンBC未満ファン_保育園・幼稚園ママ_石田真帆（34）": "persona_7.png",
-    "⑧ミノンBC未満ファン_更年期女性_杉山紀子（51）": "persona_8.jpg",
-}
+from avatars import content_hash, make_thumbnail
+from chat_turn import ChatPipeline, build_payload
+from csv_attach import DEFAULT_TOKEN_BUDGET, encode_for_budget, read_header, summarize_csv
+from dify_client import DEFAULT_CHAT_URL, DifyClient, dify_user_id
+from fanout import ask_persona, fan_out
+from live_sync import LiveSyncHub
+from local_store import LOG_COLUMNS
+from metrics import StartupReport, TurnTrace
+from personas import PERSONA_AVATARS, PersonaConfig, load_persona_config
+from rate_limit import Governor
+from resources import history_index, latency_stats, local_store, sheet_sync, sheets_configured
+from utils import IncrementalMessagesCsv, keyword_split_csv_file
+
+@st.cache_resource
+def _startup_report() -> StartupReport:
+    """プロセス起動後の最初の実行で、各段階に到達するまでの時間"""
+    return StartupReport()
+
+def mark_startup(phase: str):
+    """最初の実行でだけ、スクリプト開始からの経過時間を記録する（処理時間の集計にも startup_* で残す）"""
+    seconds = time.perf_counter() - _SCRIPT_STARTED
+    if _startup_report().mark(phase, seconds):
+        latency_stats().record(f"startup_{phase}", seconds)
+
+mark_startup("imports")
 
 # =========================
-# Google Sheets 接続ユーティリティ
+# Dify 設定
 # =========================
-def _get_sa_dict():
-    """Secretsの gcp_service_account から dict を返す（JSON文字列/TOMLテーブル両対応）"""
-    if "gcp_service_account" not in st.secrets:
-        return None
-    raw = st.secrets["gcp_service_account"]
-    if isinstance(raw, str):
-        try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
-            # private_key の実改行を \n に自動補正して再トライ（貼付ミス救済）
-            fixed = raw.replace("\r\n", "\n").replace("\n", "\\n")
-            return json.loads(fixed)
-    return dict(raw)
+DIFY_CHAT_URL = st.secrets.get("DIFY_CHAT_URL", DEFAULT_CHAT_URL)  # セルフホストの Dify を使う場合に変更
+# "streaming"（SSEで逐次表示）または "blocking"（従来通り一括応答）。Secretsで切替可能
+DIFY_RESPONSE_MODE = st.secrets.get("DIFY_RESPONSE_MODE", "streaming")
 
 @st.cache_resource
-def _gs_client():
-    """gspread クライアントを返す（キャッシュする）"""
-    import gspread
-    from google.oauth2.service_account import Credentials
-
-    sa_info = _get_sa_dict()
-    if not sa_info:
-        st.error("`gcp_service_account` がSecretsに設定されていません。")
-        st.stop()
-
-    scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-    creds = Credentials.from_service_account_info(sa_info, scopes=scopes)
-    return gspread.authorize(creds)
+def _persona_config() -> PersonaConfig:
+    """Secrets のペルソナ設定は一度だけ読み、全セッションで共有する（変更不可）"""
+    return load_persona_config(st.secrets)
 
-def _open_sheet():
-    """chat_logs ワークシートを開く（なければ作成）。権限/IDエラーはUI表示して停止。"""
-    import gspread
-    from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound, GSpreadException
+PERSONA_CONFIG = _persona_config()
+PERSONA_API_KEYS = PERSONA_CONFIG.api_keys
+mark_startup("config")
 
-    if "gsheet_id" not in st.secrets:
-        st.error("`gsheet_id` がSecretsに設定されていません。")
-        st.stop()
+@st.cache_resource(max_entries=256)
+def _avatar_thumbnail(digest: str, _data: bytes) -> bytes:
+    """画像の内容ハッシュごとに一度だけサムネイルを作って全セッションで共有する"""
+    return make_thumbnail(_data)
 
-    gc = _gs_client()
-    sheet_id = st.secrets["gsheet_id"]
+def normalize_avatar(data: bytes) -> bytes:
+    """アバター画像を小さな正方形サムネイルに変換する（同じ画像は再計算しない）"""
+    return _avatar_thumbnail(content_hash(data), data)
 
+@st.cache_resource
+def persona_avatar(path: str):
+    """ペルソナ画像のサムネイル。ファイルが無ければ None、変換できなければ元ファイルのパス"""
+    if not os.path.exists(path):
+        return None
     try:
-        sh = gc.open_by_key(sheet_id)
-    except SpreadsheetNotFound:
-        st.error("スプレッドシートが見つかりません。Secrets の `gsheet_id` を確認してください。")
-        st.stop()
-    except GSpreadException as e:
-        if "PERMISSION_DENIED" in str(e):
-            sa = _get_sa_dict()
-            st.error("スプレッドシートへのアクセス権がありません。対象シートを下記のサービスアカウントに『編集者』で共有してください。")
-            st.code(sa.get("client_email", "(unknown)"))
-            st.stop()
-        else:
-            raise
+        with open(path, "rb") as f:
+            return normalize_avatar(f.read())
+    except Exception:
+        return path
 
-    try:
-        ws = sh.worksheet("chat_logs")
-    except WorksheetNotFound:
-        ws = sh.add_worksheet(title="chat_logs", rows=1000, cols=10)
-        ws.append_row(["timestamp", "conversation_id", "bot_type", "role", "name", "content"])
-    return ws
+# =========================
+# Dify クライアント
+# =========================
+@st.cache_resource
+def _dify_client(api_key: str) -> DifyClient:
+    """APIキーごとに接続プールを共有する Dify クライアント（タイムアウト等はSecretsで調整可能）"""
+    return DifyClient(
+        api_key,
+        DIFY_CHAT_URL,
+        pool_maxsize=int(st.secrets.get("DIFY_POOL_MAXSIZE", 10)),
+        connect_timeout=float(st.secrets.get("DIFY_CONNECT_TIMEOUT", 5)),
+        read_timeout=float(st.secrets.get("DIFY_READ_TIMEOUT", 60)),
+        max_retries=int(st.secrets.get("DIFY_MAX_RETRIES", 3)),
+    )
+
+@st.cache_resource
+def _dify_governor(api_key: str) -> Governor:
+    """APIキーごとに全セッションで共有する流量制御（毎秒リクエスト数・同時実行数・先着順の待ち行列）"""
+    return Governor(
+        rate=float(st.secrets.get("DIFY_RATE_PER_SEC", 2)),
+        burst=float(st.secrets.get("DIFY_BURST", 5)),
+        max_concurrent=int(st.secrets.get("DIFY_MAX_CONCURRENCY_PER_KEY", 8)),
+    )
+
+def _export_latency_stats():
+    """METRICS_PROM_PATH が設定されていれば Prometheus テキスト形式で書き出す（textfile collector 用）"""
+    path = st.secrets.get("METRICS_PROM_PATH")
+    if path:
+        try:
+            latency_stats().write_prometheus(path)
+        except OSError:
+            pass
+
+@st.cache_resource
+def _chat_pipeline() -> ChatPipeline:
+    """ログの保存・履歴の読み込み・Dify への送信（全セッション共通。ログ保存はワーカーで応答待ちと並行）"""
+    return ChatPipeline(local_store(), get_sync=sheet_sync, get_index=history_index)
+
+def finish_log(result):
+    """保存結果を受け取る: 自分で書いた行として覚え（ライブ同期で二重に表示しない）、失敗を警告する"""
+    row_id, errors = result
+    if row_id is not None:
+        st.session_state.setdefault("own_log_ids", set()).add(row_id)
+    for where, e in errors:
+        st.warning(f"{where}へのログ保存中にエラーが発生しました: {e}")
+
+@st.cache_resource
+def _live_sync():
+    """共有会話のライブ同期（全セッション共通のポーラー）。LIVE_SYNC_INTERVAL（秒）が 0 なら無効"""
+    interval = float(st.secrets.get("LIVE_SYNC_INTERVAL", 2))
+    if interval <= 0:
+        return None
+    # シートを開けない間も同じプロセス内の参加者どうしは同期でき、ポーラーは開けるまで再試行する
+    return LiveSyncHub(local_store(), history_index if sheets_configured() else None, interval=interval)
+
+def poll_live_messages() -> bool:
+    """表示中の会話に、透かしより新しい他の参加者の行があれば messages に追加する"""
+    hub = _live_sync()
+    cid = st.session_state.cid
+    if hub is None or not cid:
+        return False
+    hub.subscribe(cid)
+    rows = local_store().rows_after(cid, st.session_state.get("live_watermark", 0))
+    if not rows:
+        return False
+    own = st.session_state.setdefault("own_log_ids", set())
+    added = False
+    for row_id, row in rows:
+        if row_id in own:
+            continue
+        st.session_state.messages.append({"role": row["role"], "content": row["content"], "name": row["name"]})
+        added = True
+    watermark = rows[-1][0]
+    st.session_state.live_watermark = watermark
+    st.session_state.own_log_ids = {i for i in own if i > watermark}
+    return added
 
 def save_log(conversation_id: str, bot_type: str, role: str, name: str, content: str):
-    """一行追記（指数バックオフの簡易リトライ付き）"""
-    from gspread.exceptions import APIError
+    """一行をローカルに保存し、Google Sheets への反映はバックグラウンドで行う（会話IDが無ければ採番待ちとして保存）"""
+    finish_log(_chat_pipeline().save_log(conversation_id, bot_type, role, name, content))
 
-    try:
-        ws = _open_sheet()
-        row = [datetime.now(timezone.utc).isoformat(), conversation_id, bot_type, role, name, content]
+def save_log_async(conversation_id: str, bot_type: str, role: str, name: str, content: str):
+    """save_log と同じ保存をバックグラウンドで始める。result() を finish_log に渡して完了させる"""
+    return _chat_pipeline().submit_log(conversation_id, bot_type, role, name, content)
 
-        for i in range(5):
-            try:
-                ws.append_row(row, value_input_option="RAW")
-                return
-            except APIError as e:
-                code = getattr(getattr(e, "response", None), "status_code", None)
-                if code in (429, 500, 503):
-                    time.sleep(1.5 ** i)
-                    continue
-                raise
-        raise RuntimeError("Google Sheets への保存に連続失敗しました。")
-    except Exception as e:
-        st.warning(f"Google Sheetsへのログ保存中にエラーが発生しました: {e}")
+def load_history(conversation_id: str) -> "pd.DataFrame":
+    """指定された会話IDの履歴を読み込む（ローカル優先。ローカルに無く、バックフィル前ならシートから該当行だけ取得）"""
+    import pandas as pd
 
-@st.cache_data(ttl=60)  # ライブ更新のため短めのTTL
-def load_history(conversation_id: str) -> pd.DataFrame:
-    """指定された会話IDの履歴をGoogle Sheetsから読み込む"""
     try:
-        ws = _open_sheet()
-        data = ws.get_all_records()
-        df = pd.DataFrame(data)
-        if df.empty:
-            return pd.DataFrame(columns=["timestamp", "conversation_id", "bot_type", "role", "name", "content"])
-
-        df_filtered = df[df["conversation_id"] == conversation_id].copy()
-        if not df_filtered.empty and "timestamp" in df_filtered.columns:
+        # シートに繋がらなくてもローカルの履歴だけで続けられるよう、シートの失敗は警告にとどめる
+        records, sheet_error = _chat_pipeline().load_history(conversation_id)
+        if sheet_error is not None:
+            st.warning(f"Google Sheetsから履歴を読み込めませんでした: {sheet_error}")
+        if not records:
+            return pd.DataFrame(columns=LOG_COLUMNS)
+
+        df_filtered = pd.DataFrame(records)
+        if "timestamp" in df_filtered.columns:
             df_filtered["timestamp"] = pd.to_datetime(df_filtered["timestamp"], errors="coerce", utc=True)
-            df_filtered = df_filtered.sort_values("timestamp")
+            df_filtered = df_filtered.sort_values("timestamp", kind="stable")
         return df_filtered
     except Exception as e:
-        st.error(f"Google Sheetsからの履歴読み込み中にエラーが発生しました: {e}")
+        st.error(f"履歴の読み込み中にエラーが発生しました: {e}")
         return pd.DataFrame()
 
+# =========================
+# アップロードCSV（内容ハッシュでパース結果をキャッシュ）
+# =========================
+@st.cache_data(max_entries=16, show_spinner=False)
+def _csv_header(digest: str, _data: bytes):
+    return read_header(_data)
+
+@st.cache_data(max_entries=16, ttl=3600, show_spinner="CSVを読み込んでいます...")
+def _summarize_uploaded_csv(digest: str, _data: bytes, usecols=None, nrows=None):
+    """同じ内容・同じ読み込み条件のCSVは再パースしない（全体は保持せず要約だけをキャッシュ）"""
+    return summarize_csv(_data, usecols=usecols, nrows=nrows)
+
+def _uploaded_digest(uploaded) -> str:
+    """アップロードファイルの内容ハッシュ（同じアップロードに対しては一度だけ計算）"""
+    file_key = getattr(uploaded, "file_id", None) or f"{uploaded.name}:{uploaded.size}"
+    cache = st.session_state.setdefault("_csv_digests", {})
+    if file_key not in cache:
+        cache.clear()
+        cache[file_key] = content_hash(uploaded.getvalue())
+    return cache[file_key]
+
 # =========================
 # Streamlit UI
 # =========================
+HISTORY_WINDOW = 30  # 一度に描画するメッセージ数（「さらに前を表示」で同じ数ずつ増やす）
+TURN_TRACE_LIMIT = 20  # デバッグ表示用に保持する直近ターンの処理時間の数
+
 st.set_page_config(page_title="ミノンBC AIファンチャット", layout="centered")
 
 # --- session_stateの初期化 ---
@@ -184,12 +212,19 @@ def init_session_state():
     st.session_state.page = "login"
     st.session_state.cid = ""
     st.session_state.messages = []
+    st.session_state.history_window = HISTORY_WINDOW
     st.session_state.bot_type = ""
     st.session_state.user_avatar_data = None
     st.session_state.name = ""
-    st.session_state.uploaded_csv_df = None
+    st.session_state.uploaded_csv_summary = None
     st.session_state.uploaded_csv_name = ""
     st.session_state.attach_csv_next_message = False
+    st.session_state.csv_token_budget = DEFAULT_TOKEN_BUDGET
+    st.session_state.fanout_cids = {}       # 同時質問モードでのペルソナごとの会話ID
+    st.session_state.fanout_results = None
+    st.session_state.turn_traces = []       # 直近ターンの段階ごとの処理時間（TurnTrace.as_row()）
+    st.session_state.live_watermark = 0     # ライブ同期: 表示済みのローカルログの最新行ID
+    st.session_state.own_log_ids = set()    # このセッションが書いた行ID（ライブ同期で二重表示しない）
 
 if "page" not in st.session_state:
     init_session_state()
@@ -222,13 +257,14 @@ if st.session_state.page == "login":
         name = st.text_input("あなたの表示名", value=st.session_state.name or "")
         bot_type = st.selectbox(
             "対話するAIペルソナ",
-            list(PERSONA_API_KEYS.keys()),
-            index=(list(PERSONA_API_KEYS.keys()).index(st.session_state.bot_type)
+            PERSONA_CONFIG.names,
+            index=(PERSONA_CONFIG.names.index(st.session_state.bot_type)
                    if st.session_state.bot_type in PERSONA_API_KEYS else 0),
         )
         existing_cid = st.text_input("既存の会話ID（共有リンクで参加する場合）", value=st.session_state.cid or "")
         uploaded_file = st.file_uploader("あなたのアバター画像（任意）", type=["png", "jpg", "jpeg"])
         submitted = st.form_submit_button("チャット開始")
+    mark_startup("login_form")
 
     if submitted:
         if not name:
@@ -238,11 +274,17 @@ if st.session_state.page == "login":
             st.session_state.bot_type = bot_type
             st.session_state.cid = existing_cid.strip()
             if uploaded_file is not None:
-                st.session_state.user_avatar_data = uploaded_file.getvalue()
+                # 元画像は保持せず、サムネイルだけをセッションに置く
+                try:
+                    st.session_state.user_avatar_data = normalize_avatar(uploaded_file.getvalue())
+                except Exception:
+                    st.warning("アバター画像を読み込めなかったため、既定のアイコンを使用します。")
+                    st.session_state.user_avatar_data = None
             else:
                 st.session_state.user_avatar_data = None
 
             st.session_state.messages = []
+            st.session_state.history_window = HISTORY_WINDOW
             st.session_state.page = "chat"
             st.rerun()
 
@@ -276,7 +318,7 @@ elif st.session_state.page == "chat":
     # --- アバター設定 ---
     assistant_avatar_file = PERSONA_AVATARS.get(st.session_state.bot_type, "default_assistant.png")
     user_avatar = st.session_state.get("user_avatar_data") if st.session_state.get("user_avatar_data") else "👤"
-    assistant_avatar = assistant_avatar_file if os.path.exists(assistant_avatar_file) else "🤖"
+    assistant_avatar = persona_avatar(assistant_avatar_file) or "🤖"
     if assistant_avatar == "🤖":
         st.info(f"アシスタントのアバター画像（{assistant_avatar_file}）が見つかりません。リポジトリのルートに画像を配置すると表示されます。")
 
@@ -285,38 +327,128 @@ elif st.session_state.page == "chat":
         uploaded_csv = st.file_uploader("CSVファイルを選択", type=["csv"])
         if uploaded_csv is not None:
             try:
-                df = pd.read_csv(uploaded_csv)
-                st.session_state.uploaded_csv_df = df
+                digest = _uploaded_digest(uploaded_csv)
+                data = uploaded_csv.getvalue()
+                usecols = st.multiselect("使用する列（未選択ならすべて）", _csv_header(digest, data))
+                nrows = st.number_input("読み込む最大行数（0ならすべて）", min_value=0, value=0, step=1000)
+                summary = _summarize_uploaded_csv(digest, data, tuple(usecols) or None, int(nrows) or None)
+                # セッションには全体ではなく要約（プレビュー・サンプル行・統計）だけを置く
+                st.session_state.uploaded_csv_summary = summary
                 st.session_state.uploaded_csv_name = getattr(uploaded_csv, "name", "uploaded.csv")
-                st.success(f"CSVを読み込みました: {st.session_state.uploaded_csv_name} ({len(df)} 行)")
-                st.dataframe(df.head(10))
+                st.success(f"CSVを読み込みました: {st.session_state.uploaded_csv_name} ({summary['rows']} 行)")
+                st.dataframe(summary["preview"])
+                st.dataframe(summary["stats"])
                 st.session_state.attach_csv_next_message = st.checkbox(
-                    "次のメッセージにこのCSVの内容を含める（先頭100行まで）",
+                    "次のメッセージにこのCSVの内容を含める（列の要約＋ランダムサンプル行）",
                     value=st.session_state.get("attach_csv_next_message", False)
                 )
+                st.session_state.csv_token_budget = st.slider(
+                    "添付サイズの上限（トークン目安）", min_value=500, max_value=16000, step=500,
+                    value=st.session_state.get("csv_token_budget", DEFAULT_TOKEN_BUDGET),
+                )
+                _, info = encode_for_budget(summary, st.session_state.csv_token_budget)
+                st.caption(
+                    f"添付予定: 約{info['tokens']}トークン（{info['chars']}文字）/ 上限 {info['budget']}トークン・"
+                    f"サンプル {info['sample_rows']}行・セル最大 {info['cell_limit']}文字"
+                )
             except Exception as e:
                 st.error(f"CSVの読み込みに失敗しました: {e}")
-                st.session_state.uploaded_csv_df = None
+                st.session_state.uploaded_csv_summary = None
+
+    # --- 複数ペルソナ同時質問 ---
+    with st.expander("複数のペルソナに同時に質問する（回答を並べて比較）"):
+        all_personas = list(PERSONA_CONFIG.names)
+        targets = st.multiselect("質問するペルソナ", all_personas, default=all_personas)
+        with st.form("fanout_form"):
+            fan_query = st.text_area("質問内容")
+            fan_submitted = st.form_submit_button("選択したペルソナに一斉送信")
+
+        # 質問と宛先がそろった送信だけを新しい質問として扱う（空の送信で前回の質問を再送しない）
+        fan_dispatch = bool(fan_submitted and fan_query.strip() and targets)
+        if fan_dispatch:
+            st.session_state.fanout_results = {"query": fan_query.strip(), "answers": {}}
+        elif fan_submitted:
+            st.warning("質問内容と質問するペルソナを入力してください。")
+        results = st.session_state.get("fanout_results")
+
+        if results:
+            st.markdown(f"**質問:** {results['query']}")
+            shown = [p for p in all_personas if p in (targets if fan_dispatch else results["answers"])]
+            grid = st.columns(2)
+            slots = {}
+            for i, persona in enumerate(shown):
+                with grid[i % 2]:
+                    with st.chat_message(persona, avatar=persona_avatar(PERSONA_AVATARS.get(persona, "")) or "🤖"):
+                        st.caption(persona)
+                        slots[persona] = st.empty()
+                        prev = results["answers"].get(persona)
+                        slots[persona].markdown(prev["answer"] if prev else "⏳ 回答を待っています...")
+
+            if fan_dispatch:
+                # 全ペルソナへ並列送信し、返ってきた順に埋める（APIキーごとの流量制御の枠内で）
+                user_id = dify_user_id(st.session_state.name)
+                fanout_cids = st.session_state.setdefault("fanout_cids", {})
+                tasks = {
+                    persona: partial(
+                        ask_persona,
+                        _dify_client(PERSONA_API_KEYS[persona]),
+                        results["query"],
+                        user_id,
+                        fanout_cids.get(persona),
+                        slot=_dify_governor(PERSONA_API_KEYS[persona]).slot(),
+                    )
+                    for persona in shown
+                }
+                for persona, res in fan_out(tasks):
+                    results["answers"][persona] = res
+                    latency_stats().record("fanout_answer", res["elapsed"], persona, error=res["error"] is not None)
+                    slots[persona].markdown(f"{res['answer']}\n\n`{res['elapsed']:.1f}s`")
+                    cid = res["conversation_id"]
+                    if cid:
+                        fanout_cids[persona] = cid
+                    # 各ペルソナの会話IDでログを残す
+                    save_log(cid, persona, "user", st.session_state.name, results["query"])
+                    save_log(cid, persona, "assistant", persona, res["answer"])
 
     # --- 履歴表示 ---
     # 1. Google Sheetsから履歴を読み込み
     if st.session_state.cid and not st.session_state.messages:
-        history_df = load_history(st.session_state.cid)
+        with latency_stats().timer("load_history"):
+            history_df = load_history(st.session_state.cid)
         if not history_df.empty:
-            for _, row in history_df.iterrows():
-                st.session_state.messages.append({
-                    "role": row["role"],
-                    "content": row["content"],
-                    "name": row["name"]
-                })
-
-    # 2. st.session_state.messages を表示
-    for msg in st.session_state.messages:
-        role = msg["role"]
-        name = msg.get("name", role)
-        avatar = assistant_avatar if role == "assistant" else user_avatar
-        with st.chat_message(name, avatar=avatar):
-            st.markdown(msg["content"])
+            st.session_state.messages.extend(history_df[["role", "content", "name"]].to_dict("records"))
+        # ここまでの行は表示済み。以降はライブ同期で新しい行だけを受け取る
+        st.session_state.live_watermark = local_store().last_id(st.session_state.cid)
+
+    # 2. st.session_state.messages を表示（直近 history_window 件だけ描画）
+    #    ライブ同期が有効なら、この部分だけを数秒ごとに再実行して他の参加者の発言を追加する
+    live_hub = _live_sync() if st.session_state.cid else None
+
+    @st.fragment(run_every=live_hub.interval if live_hub is not None else None)
+    def render_messages():
+        poll_live_messages()
+        window = st.session_state.get("history_window", HISTORY_WINDOW)
+        hidden = len(st.session_state.messages) - window
+        if hidden > 0:
+            if st.button(f"さらに前のメッセージを表示（残り {hidden} 件）"):
+                st.session_state.history_window = window + HISTORY_WINDOW
+                st.rerun()
+        for msg in st.session_state.messages[-window:]:
+            role = msg["role"]
+            name = msg.get("name", role)
+            if role == "assistant":
+                avatar = assistant_avatar
+            else:
+                # 共有会話の他の参加者には自分のアバターを使わない
+                avatar = user_avatar if name == st.session_state.name else None
+            with st.chat_message(name, avatar=avatar):
+                st.markdown(msg["content"])
+
+    render_messages()
+    if live_hub is not None:
+        st.caption(f"🔄 ライブ同期中: 同じ会話IDの他の参加者の発言を {live_hub.interval:g} 秒ごとに表示します。")
+        if live_hub.last_error is not None:
+            st.caption(f"⚠️ Google Sheets から他の参加者の発言を読み込めません（再試行中。このサーバーの参加者の発言だけを表示しています）: {live_hub.last_error}")
 
     # --- チャット入力 ---
     if user_input := st.chat_input("メッセージを入力してください"):
@@ -326,9 +458,13 @@ elif st.session_state.page == "chat":
         with st.chat_message(st.session_state.name, avatar=user_avatar):
             st.markdown(user_input)
 
-        # ユーザーメッセージをログに保存
-        save_log(
-            st.session_state.cid or "(allocating...)",
+        # 段階ごとの処理時間を計測（直近ターンはデバッグ表示、全体は集計へ）
+        trace = TurnTrace(st.session_state.bot_type, latency_stats())
+        turn_error = False
+
+        # ユーザーメッセージのログ保存は Dify の応答待ちと並行して行う（応答の保存前に完了を待つ）
+        user_log = save_log_async(
+            st.session_state.cid,
             st.session_state.bot_type,
             "user",
             st.session_state.name,
@@ -338,99 +474,75 @@ elif st.session_state.page == "chat":
         # --- Dify APIへリクエスト（安定版） ---
         api_key = PERSONA_API_KEYS.get(st.session_state.bot_type)
         if not api_key:
+            finish_log(user_log.result())
             st.error("選択されたペルソナのAPIキーが未設定です。")
             st.stop()
 
-        headers = {"Authorization": f"Bearer {api_key}"}  # Content-Type は json= が自動付与
-
-        # 表示名→英数字・短めの安定IDに正規化（表示名自体はUI表示に使い、APIには安定IDを渡す）
-        import re, hashlib
-        raw_name = st.session_state.name or "guest"
-        user_id = re.sub(r'[^A-Za-z0-9_-]', '_', raw_name).strip('_')[:64] or hashlib.md5(raw_name.encode()).hexdigest()[:16]
+        user_id = dify_user_id(st.session_state.name)
 
         # inputs は Dify 側の User Inputs とキー名を一致させること（未定義キーは送らない）
         inputs = {}
-        if st.session_state.get("attach_csv_next_message") and st.session_state.get("uploaded_csv_df") is not None:
-            df_to_send = st.session_state.uploaded_csv_df.head(100).copy()
-            # 列が多い場合の軽量化（必要に応じて上限を調整）
-            MAX_COLS = 12
-            if len(df_to_send.columns) > MAX_COLS:
-                df_to_send = df_to_send.iloc[:, :MAX_COLS]
-            try:
-                csv_text = df_to_send.to_csv(index=False)
-            except Exception:
-                csv_text = df_to_send.astype(str).to_csv(index=False)
+        if st.session_state.get("attach_csv_next_message") and st.session_state.get("uploaded_csv_summary") is not None:
+            # 列の要約＋ランダムサンプル行を、選んだトークン予算に収めて送る
+            csv_text, _ = encode_for_budget(
+                st.session_state.uploaded_csv_summary,
+                st.session_state.get("csv_token_budget", DEFAULT_TOKEN_BUDGET),
+            )
             # Dify 管理画面の User Inputs で "csv" を作っている場合のみ送る
             inputs["csv"] = csv_text
             st.session_state.attach_csv_next_message = False  # 添付後はチェックを外す
 
-        payload = {
-            "inputs": inputs,
-            "query": user_input,
-            "user": user_id,
-            "response_mode": "blocking",
-        }
-        # ★初回は conversation_id を“送らない”（空文字は入れない）
-        if st.session_state.cid:
-            payload["conversation_id"] = st.session_state.cid
+        payload = build_payload(user_input, user_id, DIFY_RESPONSE_MODE, st.session_state.cid, inputs)
 
-        def call_dify(pyld):
-            return requests.post(DIFY_CHAT_URL, headers=headers, json=pyld, timeout=60)
+        def _remember_cid(new_cid):
+            # 最初のイベントで会話IDを確定させる（途中で切断されても共有リンクを出せるように）
+            if new_cid and not st.session_state.cid:
+                st.session_state.cid = new_cid
 
         with st.chat_message(st.session_state.bot_type, avatar=assistant_avatar):
-            answer = ""
-            try:
-                with st.spinner("AIが応答を生成中です..."):
-                    res = call_dify(payload)
-
-                    # --- 400 対策：会話IDが原因っぽいときだけ1回だけフォールバック ---
-                    if res.status_code == 400 and payload.get("conversation_id"):
-                        try:
-                            errj = res.json()
-                            emsg = (errj.get("message") or errj.get("error") or errj.get("detail") or "")
-                        except Exception:
-                            emsg = res.text
-                        # "conversation", "invalid" 等の語を含む場合に会話IDを外して再送
-                        if any(k in emsg.lower() for k in ["conversation", "invalid id", "must not be empty"]):
-                            bad_cid = payload.pop("conversation_id")
-                            res = call_dify(payload)
-                            if res.ok:
-                                st.warning(f"無効な会話IDだったため新規会話で再開しました（old={bad_cid}）")
-
-                    res.raise_for_status()
-                    rj = res.json()
-                    answer = rj.get("answer", "⚠️ 応答がありませんでした。")
-
-                    # 新規会話IDが発行されたら保存
-                    new_cid = rj.get("conversation_id")
-                    if new_cid and not st.session_state.cid:
-                        st.session_state.cid = new_cid
-
-                    st.markdown(answer)
-
-            except requests.exceptions.HTTPError as e:
-                # エラーメッセージ本文をそのまま表示（原因の特定に有効）
-                body_text = getattr(e.response, "text", "(レスポンスボディ取得不可)")
-                st.error(f"⚠️ APIリクエストでHTTPエラーが発生しました (ステータスコード: {e.response.status_code})\n\n```\n{body_text}\n```")
-                answer = f"⚠️ APIリクエストでHTTPエラーが発生しました (ステータスコード: {e.response.status_code})\n\n```\n{body_text}\n```"
-            except requests.exceptions.RequestException as e:
-                st.error(f"⚠️ APIリクエストで通信エラーが発生しました: {e}")
-                answer = f"⚠️ APIリクエストで通信エラーが発生しました: {e}"
-            except Exception as e:
-                st.error(f"⚠️ 不明なエラーが発生しました: {e}")
-                answer = f"⚠️ 不明なエラーが発生しました: {e}"
+            # 同じAPIキーへの同時リクエストは全セッション共通の枠で順番に処理（待ち順を表示）
+            queue_note = st.empty()
+            streaming = payload["response_mode"] == "streaming"
+            # 届いたトークンから順に描画（カーソル付き）→ 完了後に確定表示
+            placeholder = st.empty()
+            result = _chat_pipeline().ask(
+                _dify_client(api_key),
+                payload,
+                trace,
+                governor=_dify_governor(api_key),
+                on_wait=lambda pos: queue_note.info(f"⏳ 混雑しています。順番待ち: {pos} 番目") if pos else queue_note.empty(),
+                request_context=st.spinner("AIが応答を生成中です..."),
+                on_token=(lambda text: placeholder.markdown(text + "▌")) if streaming else None,
+                on_conversation_id=_remember_cid,
+            )
+            answer = result.answer
+            if result.dropped_cid:
+                st.warning(f"無効な会話IDだったため新規会話で再開しました（old={result.dropped_cid}）")
+            if result.error is not None:
+                placeholder.empty()
+                st.error(answer)
+                turn_error = True
+            elif streaming:
+                placeholder.markdown(answer)
+            else:
+                with trace.span("render"):
+                    placeholder.markdown(answer)
 
-        # アシスタントの応答を保存
+        # ユーザー行の保存完了を待ってから応答を保存（シート上の順序を保つ）
         if answer:
-            assistant_message = {"role": "assistant", "content": answer, "name": st.session_state.bot_type}
-            st.session_state.messages.append(assistant_message)
-            save_log(
-                st.session_state.cid or "(allocating...)",
-                st.session_state.bot_type,
-                "assistant",
-                st.session_state.bot_type,
-                answer
+            st.session_state.messages.append(
+                {"role": "assistant", "content": answer, "name": st.session_state.bot_type}
             )
+        for log_result in _chat_pipeline().save_exchange(
+            trace, user_log, st.session_state.cid, st.session_state.bot_type, answer
+        ):
+            finish_log(log_result)
+
+        trace.finish(error=turn_error)
+        traces = st.session_state.setdefault("turn_traces", [])
+        traces.append(trace.as_row())
+        del traces[:-TURN_TRACE_LIMIT]
+        _export_latency_stats()
 
         # 画面を再実行して、共有リンクやダウンロードボタンを更新
         st.rerun()
@@ -438,15 +550,69 @@ elif st.session_state.page == "chat":
     # --- 操作ボタン ---
     st.markdown("---")
 
+    # ログ同期の状況（シートへ未反映の行数と直近のエラー）
+    try:
+        sync = sheet_sync()
+        if sync is None:
+            st.caption("Google Sheets が未設定のため、ログはこの環境のローカルにのみ保存されます。")
+        elif sync.queue_depth:
+            st.caption(f"📝 Google Sheetsへの反映待ち: {sync.queue_depth} 件（ローカルには保存済み）")
+        if sync is not None and sync.last_error is not None:
+            st.warning(f"Google Sheetsとの同期中にエラーが発生しました: {sync.last_error}")
+    except Exception as e:
+        st.warning(f"Google Sheetsに接続できません（ログはローカルに保存されます）: {e}")
+
+    # 処理時間の内訳（このセッションの直近ターンと、全セッションの集計）
+    # 表示するときだけ集計を組み立てる（表の描画に pandas を使うため）
+    if st.toggle("⏱ 処理時間の内訳を表示（デバッグ用）"):
+        import pandas as pd
+
+        traces = st.session_state.get("turn_traces") or []
+        if traces:
+            st.caption(f"このセッションの直近 {len(traces)} ターン（ミリ秒）")
+            st.dataframe(pd.DataFrame(traces[::-1]).fillna(""), hide_index=True)
+        else:
+            st.caption("まだ計測したターンがありません。")
+        summary = latency_stats().summary()
+        if summary:
+            st.caption("全セッションの集計（秒。分位点は直近 1000 件から）")
+            st.dataframe(pd.DataFrame(summary).round(3), hide_index=True)
+            col_jsonl, col_prom = st.columns(2)
+            col_jsonl.download_button(
+                "JSONLでダウンロード", data=latency_stats().to_jsonl(), file_name="latency_metrics.jsonl",
+                mime="application/x-ndjson",
+            )
+            col_prom.download_button(
+                "Prometheus形式でダウンロード", data=latency_stats().to_prometheus(), file_name="latency_metrics.prom",
+                mime="text/plain",
+            )
+        startup = _startup_report().as_rows()
+        if startup:
+            st.caption("プロセス起動後の最初の表示までの時間（スクリプト開始から）")
+            st.dataframe(pd.DataFrame(startup), hide_index=True)
+
     # チャット履歴ダウンロードボタン
+    # CSV はボタンが押されたときに別スレッドで作る（再実行のたびに作り直さない）。
+    # その時点のメッセージ一覧を渡す（コールバックからは session_state を参照しない）
     if st.session_state.messages:
         try:
-            df_log = pd.DataFrame(st.session_state.messages)
-            csv_bytes = df_log.to_csv(index=False).encode("utf-8-sig")  # Excelでの文字化け対策
+            messages = list(st.session_state.messages)
+            dl_format = st.radio("ダウンロード形式", ["通常", "キーワード分割"], horizontal=True)
+            if dl_format == "キーワード分割":
+                # assistant の応答を改行で分割し keyword_1.. 列に展開（逐次書き出し）
+                max_kw = st.slider("最大キーワード数", min_value=1, max_value=150, value=100)
+                csv_data = partial(keyword_split_csv_file, messages, max_keywords=max_kw)
+                file_name = f"chat_log_keywords_{st.session_state.cid or 'new'}.csv"
+            else:
+                # 前回から増えた行だけを追記エンコードする（Excelでの文字化け対策で BOM 付き）
+                if "messages_csv" not in st.session_state:
+                    st.session_state.messages_csv = IncrementalMessagesCsv()
+                csv_data = partial(st.session_state.messages_csv.update, messages)
+                file_name = f"chat_log_{st.session_state.cid or 'new'}.csv"
             st.download_button(
                 "チャット履歴をCSVでダウンロード",
-                data=csv_bytes,
-                file_name=f"chat_log_{st.session_state.cid or 'new'}.csv",
+                data=csv_data,
+                file_name=file_name,
                 mime="text/csv",
             )
         except Exception as e:
@@ -457,6 +623,11 @@ elif st.session_state.page == "chat":
         # 現在のユーザー名とボットタイプは維持しつつ、会話IDとメッセージをリセット
         st.session_state.cid = ""
         st.session_state.messages = []
+        st.session_state.history_window = HISTORY_WINDOW
+        st.session_state.fanout_cids = {}
+        st.session_state.fanout_results = None
+        st.session_state.live_watermark = 0
+        st.session_state.own_log_ids = set()
         st.success("新しい会話を開始します。")
         time.sleep(1)  # メッセージ表示のためのウェイト
         st.rerun()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""会話の文脈を持たない質問（conversation_id なし）への回答キャッシュ（LRU + TTL）"""
+import collections
+import hashlib
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# これより長い inputs の値（CSV 添付など）はハッシュにしてからキーに含める
+_INLINE_LIMIT = 256
+
+
+def _normalize_inputs(inputs):
+    normalized = {}
+    for k, v in sorted((inputs or {}).items()):
+        text = v if isinstance(v, str) else json.dumps(v, ensure_ascii=False, sort_keys=True)
+        if len(text) > _INLINE_LIMIT:
+            text = "sha256:" + hashlib.sha256(text.encode("utf-8")).hexdigest()
+        normalized[k] = text
+    return normalized
+
+
+class AnswerCache:
+    """(APIキー, 質問, inputs) → 回答 のキャッシュ。
+
+    会話IDを伴う（＝文脈のある）リクエストには使わないこと。
+    ヒットした場合は Dify を呼ばないので、新しい会話IDは発行されない
+    （続きの会話になるチャット画面・同時質問には使わず、バッチ実行の --dedupe で使う）。
+    """
+
+    def __init__(self, max_entries=512, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = collections.OrderedDict()  # key -> (保存時刻, 回答)
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> 問い合わせ中に set されるまで待つ Event
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(api_key, query, inputs=None) -> str:
+        raw = json.dumps(
+            [hashlib.sha256(api_key.encode("utf-8")).hexdigest(), query.strip(), _normalize_inputs(inputs)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key, count_miss=True):
+        """キャッシュ済みの回答（無い・期限切れなら None）。同じ問い合わせの見直しは count_miss=False"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                del self._data[key]
+                self.evictions += 1
+            if count_miss:
+                self.misses += 1
+            return None
+
+    @contextmanager
+    def single_flight(self, key):
+        """同じキーの問い合わせを1つずつにする with ブロック。
+
+        先に入ったスレッドがあれば、その処理（回答の put を含む）が終わるまで待ってから入る。
+        """
+        while True:
+            with self._lock:
+                event = self._inflight.get(key)
+                if event is None:
+                    event = self._inflight[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            event.set()
+
+    def put(self, key, answer):
+        with self._lock:
+            self._data[key] = (time.monotonic(), answer)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
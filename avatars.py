@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""アバター画像を小さな正方形サムネイルに変換する"""
+import hashlib
+import io
+
+AVATAR_SIZE = 96
+
+
+def content_hash(data: bytes) -> str:
+    """画像バイト列のキャッシュキー"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_thumbnail(data: bytes, size: int = AVATAR_SIZE) -> bytes:
+    """中央を正方形に切り抜いて size×size に縮小し、WebP（非対応環境では PNG）で返す"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)  # スマホ写真の回転を反映
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img = ImageOps.fit(img, (size, size), Image.LANCZOS)
+
+        out = io.BytesIO()
+        try:
+            img.save(out, format="WEBP", quality=85, method=4)
+        except (KeyError, OSError):
+            out = io.BytesIO()
+            img.save(out, format="PNG", optimize=True)
+        return out.getvalue()
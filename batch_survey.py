@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""質問CSV × ペルソナ を Dify にまとめて投げるバッチ実行（Streamlit を使わない CLI）
+
+使い方:
+    python batch_survey.py questions.csv -o results.csv
+    python batch_survey.py questions.csv -o results.parquet --personas 1,2,5 --workers 8 --rate 0.5
+
+- 質問CSVは `question` 列（無ければ先頭列）を質問、`id` 列があれば質問IDとして使う
+- Secrets は `.streamlit/secrets.toml`（アプリと同じキー名）から読む
+- 結果は1件ごとにチェックポイント（既定: <出力>.checkpoint.jsonl）へ追記する。
+  中断後に同じコマンドを再実行すると、成功済みの組み合わせは飛ばして続きから実行する
+- 最後にチェックポイントから出力ファイル（CSV / Parquet、キーワード分割列付き）を書き出す
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+from answer_cache import AnswerCache
+from dify_client import DEFAULT_CHAT_URL, DifyClient, dify_user_id
+from fanout import ask_persona
+from personas import PERSONA_NAMES, get_persona_api_keys
+from rate_limit import Governor
+from utils import iter_keyword_split_csv, iter_keyword_split_rows
+
+RESULT_COLUMNS = ["question_id", "question", "persona", "conversation_id", "elapsed", "error", "finished_at"]
+
+
+def load_secrets(path):
+    """secrets.toml を dict で読む（無ければ空）"""
+    if not os.path.exists(path):
+        return {}
+    try:
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f)
+    except ImportError:  # Python 3.10 以前
+        import toml
+        return toml.load(path)
+
+
+def read_questions(path, column=None):
+    """[(質問ID, 質問), ...] を返す"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        fields = reader.fieldnames or []
+        if not fields:
+            return []
+        qcol = column or ("question" if "question" in fields else fields[0])
+        if qcol not in fields:
+            raise SystemExit(f"質問列 `{qcol}` が見つかりません（列: {', '.join(fields)}）")
+        questions = []
+        for i, row in enumerate(reader, start=1):
+            q = (row.get(qcol) or "").strip()
+            if q:
+                questions.append((str(row.get("id") or i), q))
+        return questions
+
+
+def select_personas(api_keys, spec):
+    """--personas "1,3,5"（番号）で絞り込む。未指定なら APIキーのある全ペルソナ"""
+    if not spec:
+        return [p for p in PERSONA_NAMES if p in api_keys]
+    selected = []
+    for token in spec.split(","):
+        idx = int(token.strip()) - 1
+        if not 0 <= idx < len(PERSONA_NAMES):
+            raise SystemExit(f"ペルソナ番号 {token.strip()} は範囲外です（1〜{len(PERSONA_NAMES)}）")
+        name = PERSONA_NAMES[idx]
+        if name not in api_keys:
+            raise SystemExit(f"{name} のAPIキーが Secrets にありません。")
+        selected.append(name)
+    return selected
+
+
+def load_checkpoint(path):
+    """{(質問ID, ペルソナ): 記録} を返す（同じ組は後の記録を優先）"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断時の書きかけ行
+            done[(rec["question_id"], rec["persona"])] = rec
+    return done
+
+
+def export_results(records, output, max_keywords):
+    """記録を CSV / Parquet に書き出す（assistant の回答は keyword_1.. 列に展開）"""
+    tmp = output + ".tmp"
+    if output.lower().endswith(".parquet"):
+        try:
+            import pandas as pd
+            rows = iter_keyword_split_rows(records, max_keywords, extra_columns=RESULT_COLUMNS)
+            header = next(rows)
+            pd.DataFrame(list(rows), columns=header).to_parquet(tmp, index=False)
+        except ImportError as e:
+            raise SystemExit(f"Parquet 出力には pyarrow が必要です: {e}")
+    else:
+        with open(tmp, "wb") as f:
+            for chunk in iter_keyword_split_csv(records, max_keywords, extra_columns=RESULT_COLUMNS):
+                f.write(chunk)
+    os.replace(tmp, output)
+
+
+def _open_log(secrets, mirror_to_sheets):
+    """アプリと同じローカルログ（と必要なら Sheets ミラー）を開く"""
+    from local_store import ChatLogStore
+
+    store = ChatLogStore(secrets.get("LOCAL_DB_PATH", "chat_logs.sqlite3"))
+    sync = None
+    if mirror_to_sheets:
+        from sheet_sync import SheetSynchronizer
+        from sheets import open_log_worksheet
+
+        sync = SheetSynchronizer(store, open_log_worksheet(secrets), backfill=False)
+    return store, sync
+
+
+def _log_exchange(store, sync, record, user_name):
+    """1件の質問と回答をアプリと同じログに保存する（キャッシュから返した回答は会話が無いので呼ばないこと）"""
+    cid = record["conversation_id"] or "(allocating...)"
+    now = datetime.now(timezone.utc).isoformat()
+    for role, name, content in (("user", user_name, record["question"]),
+                                ("assistant", record["persona"], record["content"])):
+        row = [now, cid, record["persona"], role, name, content]
+        row_id = store.append(row)
+        if sync is not None:
+            sync.mirror(row_id, row)
+
+
+def run(args):
+    secrets = load_secrets(args.secrets)
+    api_keys = get_persona_api_keys(secrets)
+    if not api_keys:
+        raise SystemExit(f"APIキーが一つも見つかりません（{args.secrets} に PERSONA_1_KEY などを設定してください）")
+    personas = select_personas(api_keys, args.personas)
+    questions = read_questions(args.questions, args.question_column)
+
+    checkpoint = args.checkpoint or args.output + ".checkpoint.jsonl"
+    done = load_checkpoint(checkpoint)
+    todo = [(qid, q, p) for qid, q in questions for p in personas
+            if (qid, p) not in done or done[(qid, p)].get("error")]
+    total = len(questions) * len(personas)
+    print(f"{len(questions)} 問 × {len(personas)} ペルソナ = {total} 件（実行済み {total - len(todo)} 件、残り {len(todo)} 件）",
+          file=sys.stderr)
+
+    chat_url = secrets.get("DIFY_CHAT_URL", DEFAULT_CHAT_URL)
+    clients, governors = {}, {}
+    for p in personas:
+        key = api_keys[p]
+        if key not in clients:
+            clients[key] = DifyClient(key, chat_url, pool_maxsize=args.per_key_concurrency,
+                                      read_timeout=args.read_timeout)
+            governors[key] = Governor(args.rate, burst=max(1.0, args.rate), max_concurrent=args.per_key_concurrency)
+    user_id = dify_user_id(args.user)
+    # 同じ質問文が複数行ある場合、ペルソナごとに1回だけ問い合わせて回答を使い回す
+    cache = AnswerCache(max_entries=max(1, len(todo)), ttl=float("inf")) if args.dedupe else None
+
+    def task(qid, question, persona):
+        key = api_keys[persona]
+        res = ask_persona(clients[key], question, user_id, slot=governors[key].slot(), cache=cache)
+        return {
+            "question_id": qid,
+            "question": question,
+            "persona": persona,
+            "role": "assistant",
+            "name": persona,
+            "content": res["answer"],
+            "conversation_id": res["conversation_id"] or "",
+            "elapsed": round(res["elapsed"], 3),
+            "error": str(res["error"]) if res["error"] else "",
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "cached": res["cached"],
+        }
+
+    store = sync = None
+    if args.log or args.sheets:
+        store, sync = _open_log(secrets, args.sheets)
+
+    interrupted = False
+    pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="batch-survey")
+    try:
+        futures = [pool.submit(task, qid, q, p) for qid, q, p in todo]
+        with open(checkpoint, "a", encoding="utf-8") as ckpt:
+            for n, fut in enumerate(as_completed(futures), start=1):
+                rec = fut.result()
+                ckpt.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                ckpt.flush()
+                done[(rec["question_id"], rec["persona"])] = rec
+                # --dedupe でキャッシュから返した回答は、最初に問い合わせた分がログ済みなので残さない
+                if store is not None and not rec["error"] and not rec.get("cached"):
+                    _log_exchange(store, sync, rec, args.user)
+                status = "NG " + rec["error"][:80] if rec["error"] else ("ok (重複)" if rec.get("cached") else "ok")
+                print(f"[{n}/{len(todo)}] Q{rec['question_id']} {rec['persona']} {rec['elapsed']:.1f}s {status}",
+                      file=sys.stderr)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("中断しました。ここまでの結果を書き出します（再実行で続きから再開できます）。", file=sys.stderr)
+        pool.shutdown(wait=False, cancel_futures=True)
+    finally:
+        pool.shutdown(wait=not interrupted)
+        if sync is not None:
+            sync.writer.close()
+
+    order_q = {qid: i for i, (qid, _) in enumerate(questions)}
+    order_p = {p: i for i, p in enumerate(personas)}
+    records = sorted(
+        (r for r in done.values() if r["question_id"] in order_q and r["persona"] in order_p),
+        key=lambda r: (order_q[r["question_id"]], order_p[r["persona"]]),
+    )
+    export_results(records, args.output, args.max_keywords)
+    failed = sum(1 for r in records if r["error"])
+    print(f"{args.output} に {len(records)} 件を書き出しました（エラー {failed} 件）", file=sys.stderr)
+    return 130 if interrupted else (1 if failed else 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="質問CSVを全ペルソナに投げて回答を集める（バッチ実行）")
+    parser.add_argument("questions", help="質問CSVのパス")
+    parser.add_argument("-o", "--output", required=True, help="出力ファイル（.csv または .parquet）")
+    parser.add_argument("--question-column", help="質問の列名（既定: question、無ければ先頭列）")
+    parser.add_argument("--personas", help="対象ペルソナの番号をカンマ区切りで（例: 1,3,5）。既定は全ペルソナ")
+    parser.add_argument("--workers", type=int, default=8, help="全体の同時実行数（既定 8）")
+    parser.add_argument("--per-key-concurrency", type=int, default=2, help="APIキーごとの同時実行数（既定 2）")
+    parser.add_argument("--rate", type=float, default=1.0, help="APIキーごとの最大リクエスト数/秒（既定 1.0）")
+    parser.add_argument("--read-timeout", type=float, default=120.0, help="Dify 応答の読み取りタイムアウト秒（既定 120）")
+    parser.add_argument("--max-keywords", type=int, default=100, help="キーワード分割の最大列数（既定 100）")
+    parser.add_argument("--checkpoint", help="チェックポイントのパス（既定: <出力>.checkpoint.jsonl）")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"), help="secrets.toml のパス")
+    parser.add_argument("--user", default="batch", help="Dify に渡すユーザー名・ログの表示名（既定 batch）")
+    parser.add_argument("--dedupe", action="store_true", help="同じ質問文は各ペルソナに1回だけ問い合わせ、回答を使い回す")
+    parser.add_argument("--log", action="store_true", help="アプリと同じローカルログ（SQLite）にも保存する")
+    parser.add_argument("--sheets", action="store_true", help="ログを Google Sheets にもミラーする（--log を含む）")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""オフラインのベンチマーク（Dify・Google Sheets を使わずにローカルで計測する）"""
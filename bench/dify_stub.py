@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Dify の /v1/chat-messages を模したローカルのスタブサーバー（blocking / streaming）
+
+単体でも起動できる:
+    python -m bench.dify_stub --port 8765 --latency 0.3 --error-rate 0.05
+
+- latency: 応答開始までの待ち（秒）。jitter で ±ランダムに揺らす
+- streaming: answer を tokens 個の message イベントに分け、token_delay 秒ずつ間隔を空けて送る
+- error_rate: その割合で 503 を返す（DifyClient の再試行の確認用）
+- 発行済みでない conversation_id には Dify と同じく 400 "Conversation Not Exists." を返す
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, latency=0.2, jitter=0.0, token_delay=0.01, tokens=20, error_rate=0.0, keywords=10, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.keywords = keywords
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.conversations = set()
+        self.requests = 0
+        self.errors = 0
+
+    def _random(self):
+        with self.lock:
+            return self.rng.random()
+
+
+def _answer(query, keywords):
+    """キーワード分割の対象になるよう改行区切りの回答を作る"""
+    return "\n".join([f"{query[:20]} に関するキーワード{i}" for i in range(1, keywords + 1)])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive（DifyClient の接続プールを効かせる）
+    config = None  # StubConfig（サーバーごとにサブクラスで設定）
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        cfg = self.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        with cfg.lock:
+            cfg.requests += 1
+
+        delay = cfg.latency + (cfg._random() * 2 - 1) * cfg.jitter
+        time.sleep(max(0.0, delay))
+        if cfg.error_rate and cfg._random() < cfg.error_rate:
+            with cfg.lock:
+                cfg.errors += 1
+            self._send_json(503, {"code": "unavailable", "message": "stub: injected error"})
+            return
+
+        cid = body.get("conversation_id")
+        if cid:
+            with cfg.lock:
+                known = cid in cfg.conversations
+            if not known:
+                self._send_json(400, {"code": "not_found", "message": "Conversation Not Exists."})
+                return
+        else:
+            cid = str(uuid.uuid4())
+            with cfg.lock:
+                cfg.conversations.add(cid)
+
+        answer = _answer(body.get("query") or "", cfg.keywords)
+        if body.get("response_mode") != "streaming":
+            self._send_json(200, {"event": "message", "answer": answer, "conversation_id": cid,
+                                  "message_id": str(uuid.uuid4())})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        step = max(1, len(answer) // max(1, cfg.tokens))
+        pieces = [answer[i:i + step] for i in range(0, len(answer), step)]
+        events = [{"event": "message", "answer": p, "conversation_id": cid} for p in pieces]
+        events.append({"event": "message_end", "conversation_id": cid})
+        for i, ev in enumerate(events):
+            if i and cfg.token_delay:
+                time.sleep(cfg.token_delay)
+            data = ("data: " + json.dumps(ev, ensure_ascii=False) + "\n\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class DifyStub:
+    """with DifyStub(config) as stub: stub.url に DifyClient を向ける（空きポートで起動）"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or StubConfig()
+        handler = type("Handler", (_Handler,), {"config": self.config})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="dify-stub", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1/chat-messages"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Dify chat-messages のローカルスタブ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="応答開始までの秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="latency の揺らぎ（±秒）")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="streaming のイベント間隔（秒）")
+    parser.add_argument("--tokens", type=int, default=20, help="streaming で answer を分割する数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="503 を返す割合（0〜1）")
+    parser.add_argument("--keywords", type=int, default=10, help="回答の行数")
+    args = parser.parse_args(argv)
+    config = StubConfig(args.latency, args.jitter, args.token_delay, args.tokens, args.error_rate, args.keywords)
+    stub = DifyStub(config, args.host, args.port)
+    print(f"Dify スタブ: {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
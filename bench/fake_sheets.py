@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""gspread の Worksheet のうちアプリが使うメソッドだけを持つインメモリの代役"""
+import re
+import threading
+import time
+
+from local_store import LOG_COLUMNS
+
+_CELL = re.compile(r"([A-Z]+)(\d*)")
+
+
+def _col_number(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - ord("A") + 1
+    return n
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class FakeAPIError(Exception):
+    """gspread.exceptions.APIError と同じく response.status_code を持つ"""
+
+    def __init__(self, status_code):
+        super().__init__(f"fake sheets: HTTP {status_code}")
+        self.response = FakeResponse(status_code)
+
+
+class FakeWorksheet:
+    """chat_logs ワークシートの代役。
+
+    - latency: API 呼び出し1回ごとの待ち（秒）。Sheets の往復時間の代わり
+    - error_every: N 回に1回 429 を返す（0 なら返さない）
+    - calls: メソッドごとの呼び出し回数
+    """
+
+    def __init__(self, header=LOG_COLUMNS, latency=0.0, error_every=0):
+        self._rows = [list(header)]
+        self._lock = threading.Lock()
+        self.latency = latency
+        self.error_every = error_every
+        self.calls = {}
+        self._count = 0
+
+    def _api(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self._count += 1
+            failing = self.error_every and self._count % self.error_every == 0
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            raise FakeAPIError(429)
+
+    def _range(self, a1):
+        """"A2:F100" / "C2:C" を (行開始, 行終了 or None, 列開始, 列終了) にする（1始まり）"""
+        start, _, end = a1.partition(":")
+        c1, r1 = _CELL.fullmatch(start).groups()
+        c2, r2 = _CELL.fullmatch(end or start).groups()
+        return int(r1 or 1), (int(r2) if r2 else None), _col_number(c1), _col_number(c2)
+
+    def _slice(self, a1):
+        r1, r2, c1, c2 = self._range(a1)
+        with self._lock:
+            rows = self._rows[r1 - 1: r2]
+        out = [[str(v) for v in row[c1 - 1: c2]] for row in rows]
+        while out and not any(out[-1]):
+            out.pop()  # gspread と同じく末尾の空行は返さない
+        return out
+
+    # ---- gspread 互換 API ----
+    def row_values(self, row):
+        self._api("row_values")
+        with self._lock:
+            return [str(v) for v in self._rows[row - 1]] if row <= len(self._rows) else []
+
+    def get(self, a1):
+        self._api("get")
+        return self._slice(a1)
+
+    def batch_get(self, ranges):
+        self._api("batch_get")
+        return [self._slice(a1) for a1 in ranges]
+
+    def append_rows(self, rows, value_input_option=None):
+        self._api("append_rows")
+        with self._lock:
+            self._rows.extend(list(r) for r in rows)
+
+    def append_row(self, row, value_input_option=None):
+        self.append_rows([row], value_input_option)
+
+    # ---- ベンチ用 ----
+    @property
+    def row_count(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def preload(self, rows):
+        """API 呼び出しとして数えずに行を追加する（既存ログの再現用）"""
+        with self._lock:
+            self._rows.extend(list(r) for r in rows)
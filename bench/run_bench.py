@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""チャット1ターンの処理とCSV書き出しのベンチマーク（Dify・Google Sheets はローカルの代役）
+
+使い方（リポジトリのルートで）:
+    python -m bench.run_bench turn --sessions 1,4,16 --history 0,200 --sheet-rows 1000,50000
+    python -m bench.run_bench turn --mode streaming --latency 0.5 --error-rate 0.05
+    python -m bench.run_bench export --messages 1000,10000,100000
+
+turn:   アプリと同じ chat_turn.ChatPipeline（save_log → Dify 送信 → 応答の受信 → save_log）を、
+        同時セッション数・履歴の長さ・シートの行数を変えて動かし、ターンの処理時間（p50/p95/p99）と
+        スループットを測る。各セッションは最初に履歴を読み込む（--backfill なしならローカルに無い履歴は
+        シートから該当行だけ取得＝アプリの起動直後と同じ経路）
+export: utils.prepare_keyword_split_csv / keyword_split_csv_file の処理時間とピークメモリ（tracemalloc）を測る
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from bench.dify_stub import DifyStub, StubConfig
+from bench.fake_sheets import FakeWorksheet
+from chat_turn import ChatPipeline, build_payload
+from dify_client import DifyClient
+from history_index import SheetHistoryIndex
+from local_store import ChatLogStore
+from metrics import LatencyStats, TurnTrace
+from rate_limit import Governor
+from sheet_sync import SheetSynchronizer
+from utils import keyword_split_csv_file, prepare_keyword_split_csv
+
+PERSONA = "bench-persona"
+
+
+def _ints(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def run_turn(pipeline, client, governor, mode, stats, session):
+    """アプリのチャット入力1回分（ユーザー行の保存は Dify の応答待ちと並行）"""
+    trace = TurnTrace(PERSONA, stats)
+    query = f"{session['user']} の質問 {session['turns'] + 1}"
+    user_log = pipeline.submit_log(session["cid"], PERSONA, "user", session["user"], query)
+    payload = build_payload(query, session["user"], mode, session["cid"])
+    result = pipeline.ask(client, payload, trace, governor=governor)
+    if result.conversation_id and not session["cid"]:
+        session["cid"] = result.conversation_id
+    pipeline.save_exchange(trace, user_log, session["cid"], PERSONA, result.answer)
+    trace.finish(error=result.error is not None)
+    session["turns"] += 1
+
+
+def _preload_sheet(ws, sheet_rows, sessions, history, stub):
+    """既存ログを再現する: 各セッションの会話に history 行、残りは他の会話の行"""
+    rows = []
+    cids = []
+    for s in range(sessions):
+        cid = str(uuid.uuid4()) if history else ""
+        cids.append(cid)
+        if cid:
+            stub.config.conversations.add(cid)
+            for i in range(history):
+                role = "user" if i % 2 == 0 else "assistant"
+                rows.append([_now(), cid, PERSONA, role, f"user{s}" if role == "user" else PERSONA, f"履歴 {i}"])
+    filler_cids = [str(uuid.uuid4()) for _ in range(max(1, sheet_rows // 50))]
+    for i in range(max(0, sheet_rows - len(rows))):
+        rows.append([_now(), filler_cids[i % len(filler_cids)], PERSONA, "user", "other", f"他の会話 {i}"])
+    # 各セッションの行がシート全体に散らばるよう並べ替える（実運用と同じく会話が交互に追記される想定）
+    random.Random(0).shuffle(rows)
+    ws.preload(rows)
+    return cids
+
+
+def run_turn_case(args, mode, sessions, history, sheet_rows):
+    stats = LatencyStats(window=100_000)
+    config = StubConfig(latency=args.latency, jitter=args.jitter, token_delay=args.token_delay,
+                        tokens=args.tokens, error_rate=args.error_rate, keywords=args.keywords, seed=0)
+    with DifyStub(config) as stub, tempfile.TemporaryDirectory() as tmp:
+        ws = FakeWorksheet(latency=args.sheets_latency)
+        cids = _preload_sheet(ws, sheet_rows, sessions, history, stub)
+        store = ChatLogStore(os.path.join(tmp, "bench.sqlite3"))
+        sync = SheetSynchronizer(store, ws, backfill=args.backfill, metrics=stats)
+        if args.backfill:
+            sync.backfill_done.wait()
+        index = SheetHistoryIndex(ws, metrics=stats)
+        client = DifyClient("app-bench", stub.url, pool_maxsize=max(10, sessions),
+                            read_timeout=30, max_retries=args.retries)
+        governor = Governor(args.rate, burst=max(1.0, args.rate), max_concurrent=args.per_key_concurrency)
+        pipeline = ChatPipeline(store, get_sync=lambda: sync, get_index=lambda: index)
+
+        def session_main(n):
+            session = {"user": f"user{n}", "cid": cids[n], "turns": 0}
+            if session["cid"]:
+                with stats.timer("load_history", PERSONA):
+                    _, error = pipeline.load_history(session["cid"])
+                if error is not None:
+                    raise error
+            for _ in range(args.turns):
+                run_turn(pipeline, client, governor, mode, stats, session)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(session_main, range(sessions)))
+        wall = time.perf_counter() - started
+
+        drain_started = time.perf_counter()
+        sync.writer.flush(timeout=60)
+        drain = time.perf_counter() - drain_started
+        sync.writer.close()
+        pipeline.close()
+
+    by_stage = {row["stage"]: row for row in stats.summary()}
+
+    def pick(stage, key):
+        row = by_stage.get(stage)
+        return None if row is None or row[key] is None else round(row[key] * 1000, 1)
+
+    turn = by_stage.get("turn", {})
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "history": history,
+        "sheet_rows": sheet_rows,
+        "turns": turn.get("count", 0),
+        "errors": turn.get("errors", 0),
+        "turns_per_sec": round(turn.get("count", 0) / wall, 2) if wall else None,
+        "turn_p50_ms": pick("turn", "p50"),
+        "turn_p95_ms": pick("turn", "p95"),
+        "turn_p99_ms": pick("turn", "p99"),
+        "dify_request_p50_ms": pick("dify_request", "p50"),
+        "dify_queue_p95_ms": pick("dify_queue", "p95"),
+        "save_log_p95_ms": pick("save_log", "p95"),
+        "load_history_p50_ms": pick("load_history", "p50"),
+        "load_history_p95_ms": pick("load_history", "p95"),
+        "sheets_append_calls": ws.calls.get("append_rows", 0),
+        "sheets_drain_s": round(drain, 2),
+        "stub_requests": config.requests,
+    }
+
+
+def run_export_case(size, keywords, max_keywords):
+    messages = []
+    for i in range(size):
+        if i % 2 == 0:
+            messages.append({"role": "user", "name": "bench", "content": f"質問 {i}"})
+        else:
+            content = "\n".join(f"キーワード{i}-{k}" for k in range(keywords))
+            messages.append({"role": "assistant", "name": PERSONA, "content": content})
+
+    results = []
+    for label, fn in (("prepare_keyword_split_csv", prepare_keyword_split_csv),
+                      ("keyword_split_csv_file", keyword_split_csv_file)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        out = fn(messages, max_keywords=max_keywords)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if hasattr(out, "seek"):
+            out.seek(0, os.SEEK_END)
+            nbytes = out.tell()
+            out.close()
+        else:
+            nbytes = len(out)
+        results.append({
+            "function": label,
+            "messages": size,
+            "keywords": keywords,
+            "seconds": round(elapsed, 3),
+            "peak_mb": round(peak / 1024 / 1024, 2),
+            "output_mb": round(nbytes / 1024 / 1024, 2),
+        })
+    return results
+
+
+def _print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0])
+    widths = {c: max(len(c), *(len("" if r[c] is None else str(r[c])) for r in rows)) for c in columns}
+    print("  ".join(c.rjust(widths[c]) for c in columns))
+    for r in rows:
+        print("  ".join(("" if r[c] is None else str(r[c])).rjust(widths[c]) for c in columns))
+    sys.stdout.flush()
+
+
+def _write_jsonl(path, kind, rows):
+    if not path:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps({"time": _now(), "bench": kind, **row}, ensure_ascii=False) + "\n")
+
+
+def cmd_turn(args):
+    rows = []
+    for mode, sessions, history, sheet_rows in itertools.product(
+        args.mode.split(","), _ints(args.sessions), _ints(args.history), _ints(args.sheet_rows)
+    ):
+        print(f"... {mode} sessions={sessions} history={history} sheet_rows={sheet_rows}", file=sys.stderr)
+        rows.append(run_turn_case(args, mode, sessions, history, sheet_rows))
+    _print_table(rows)
+    _write_jsonl(args.json, "turn", rows)
+
+
+def cmd_export(args):
+    rows = []
+    for size in _ints(args.messages):
+        print(f"... messages={size}", file=sys.stderr)
+        rows.extend(run_export_case(size, args.keywords, args.max_keywords))
+    _print_table(rows)
+    _write_jsonl(args.json, "export", rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="オフラインのベンチマーク（Dify / Google Sheets はローカルの代役）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    turn = sub.add_parser("turn", help="チャットターンの処理時間とスループット")
+    turn.add_argument("--mode", default="blocking,streaming", help="blocking / streaming（カンマ区切りで複数）")
+    turn.add_argument("--sessions", default="1,4,16", help="同時セッション数（カンマ区切り）")
+    turn.add_argument("--turns", type=int, default=5, help="セッションごとのターン数")
+    turn.add_argument("--history", default="0,100", help="各セッションの既存履歴の行数（カンマ区切り）")
+    turn.add_argument("--sheet-rows", default="1000,20000", help="シートの既存行数（カンマ区切り）")
+    turn.add_argument("--latency", type=float, default=0.2, help="Dify スタブの応答開始までの秒数")
+    turn.add_argument("--jitter", type=float, default=0.05, help="latency の揺らぎ（±秒）")
+    turn.add_argument("--token-delay", type=float, default=0.01, help="streaming のイベント間隔（秒）")
+    turn.add_argument("--tokens", type=int, default=20, help="streaming で answer を分割する数")
+    turn.add_argument("--keywords", type=int, default=10, help="回答の行数")
+    turn.add_argument("--error-rate", type=float, default=0.0, help="Dify スタブが 503 を返す割合")
+    turn.add_argument("--retries", type=int, default=3, help="DifyClient の再試行回数")
+    turn.add_argument("--rate", type=float, default=1000.0, help="APIキーあたりの毎秒リクエスト数の上限")
+    turn.add_argument("--per-key-concurrency", type=int, default=8, help="APIキーあたりの同時リクエスト数")
+    turn.add_argument("--sheets-latency", type=float, default=0.05, help="シートの API 呼び出し1回の秒数")
+    turn.add_argument("--backfill", action="store_true", help="先にシート全体をローカルへ取り込んでから計測する")
+    turn.add_argument("--json", help="結果を JSONL で追記するパス")
+    turn.set_defaults(func=cmd_turn)
+
+    export = sub.add_parser("export", help="キーワード分割CSVの書き出し時間とピークメモリ")
+    export.add_argument("--messages", default="1000,10000,100000", help="メッセージ数（カンマ区切り）")
+    export.add_argument("--keywords", type=int, default=20, help="assistant メッセージあたりの行数")
+    export.add_argument("--max-keywords", type=int, default=100, help="キーワード列の上限")
+    export.add_argument("--json", help="結果を JSONL で追記するパス")
+    export.set_defaults(func=cmd_export)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""チャット1ターンの処理（ログ保存・履歴読み込み・Dify への送信と応答の受信）
+
+Streamlit には依存しない。アプリ（AI Persona MinonBC.py）とベンチマーク（bench/run_bench.py）が
+同じ処理を使い、画面への表示は呼び出し側がコールバックで行う。
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+from dify_client import describe_error, post_with_cid_fallback, stream_dify_answer
+
+PENDING_CID = "(allocating...)"  # 会話IDが発行される前の行に入れる値
+NO_ANSWER = "⚠️ 応答がありませんでした。"
+
+
+def build_payload(query, user_id, response_mode, conversation_id=None, inputs=None) -> dict:
+    """chat-messages の送信内容。inputs は Dify 側の User Inputs とキー名を一致させること"""
+    payload = {
+        "inputs": inputs or {},
+        "query": query,
+        "user": user_id,
+        "response_mode": response_mode,
+    }
+    # ★初回は conversation_id を“送らない”（空文字は入れない）
+    if conversation_id:
+        payload["conversation_id"] = conversation_id
+    return payload
+
+
+def log_row(conversation_id, bot_type, role, name, content) -> list:
+    """ログの1行（LOG_COLUMNS 順。時刻はこの時点）"""
+    return [datetime.now(timezone.utc).isoformat(), conversation_id or PENDING_CID, bot_type, role, name, content]
+
+
+def write_log_row(store, sync, row, sync_error=None):
+    """1行をローカルに保存し、シートへのミラーを予約する。(行ID, [(保存先, 例外), ...]) を返す"""
+    errors = []
+    row_id = None
+    try:
+        row_id = store.append(row)
+    except Exception as e:
+        errors.append(("ローカル", e))
+    if sync_error is not None:
+        errors.append(("Google Sheets", sync_error))
+    elif sync is not None:
+        try:
+            sync.mirror(row_id, row)
+        except Exception as e:
+            errors.append(("Google Sheets", e))
+    return row_id, errors
+
+
+class TurnResult(NamedTuple):
+    answer: str                        # エラー時は describe_error() の文面
+    conversation_id: Optional[str]
+    error: Optional[Exception] = None
+    dropped_cid: Optional[str] = None  # 無効だったため外して再送した会話ID
+
+
+class ChatPipeline:
+    """ログの保存先（ローカル SQLite と Google Sheets へのミラー）と Dify への送信をまとめたもの。
+
+    get_sync / get_index は SheetSynchronizer / SheetHistoryIndex を返す関数（Sheets を使わないなら
+    None を渡すか None を返す）。シートを開けずに例外になっても、ローカルへの保存と読み込みは続ける。
+    ログの保存はワーカースレッドで行い、Dify の応答待ちと並行させる。
+    """
+
+    def __init__(self, store, get_sync=None, get_index=None, log_workers=4):
+        self.store = store
+        self._get_sync = get_sync
+        self._get_index = get_index
+        self.log_executor = ThreadPoolExecutor(max_workers=log_workers, thread_name_prefix="chat-log")
+
+    # ---- ログ ----
+    def submit_log(self, conversation_id, bot_type, role, name, content):
+        """行を組み立て（時刻はこの時点）、保存をワーカーに投げて Future を返す（結果は write_log_row と同じ）"""
+        row = log_row(conversation_id, bot_type, role, name, content)
+        sync, sync_error = None, None
+        if self._get_sync is not None:
+            try:
+                sync = self._get_sync()
+            except Exception as e:
+                sync_error = e  # シートを開けなくてもローカルには保存する
+        return self.log_executor.submit(write_log_row, self.store, sync, row, sync_error)
+
+    def save_log(self, conversation_id, bot_type, role, name, content):
+        """submit_log して完了を待つ"""
+        return self.submit_log(conversation_id, bot_type, role, name, content).result()
+
+    def load_history(self, conversation_id):
+        """(行の list, シートの例外 or None)。ローカル優先で、ローカルに無くバックフィル前ならシートから該当行だけ取得"""
+        records = self.store.history(conversation_id)
+        if records or self._get_sync is None:
+            return records, None
+        try:
+            sync = self._get_sync()
+            if sync is not None and not sync.backfill_done.is_set():
+                records = self._get_index().rows_for(conversation_id)
+                self.store.import_rows(records)
+        except Exception as e:
+            return [], e
+        return records, None
+
+    def save_exchange(self, trace, user_log, conversation_id, bot_type, answer) -> list:
+        """ユーザー行の保存完了を待ってから応答を保存する（シート上の順序を保つ）。両方の保存結果を返す"""
+        with trace.span("save_log_wait"):
+            results = [user_log.result()]
+        if answer:
+            with trace.span("save_log"):
+                results.append(self.save_log(conversation_id, bot_type, "assistant", bot_type, answer))
+        return results
+
+    # ---- Dify ----
+    def ask(self, client, payload, trace, governor=None, on_wait=None, request_context=None,
+            on_token=None, on_conversation_id=None) -> TurnResult:
+        """Dify に送信して応答を受け取る。例外は TurnResult.error に入れて返す。
+
+        governor:           同じAPIキーの全セッションで共有する流量制御（順番待ちの間は on_wait(順番)、
+                            順番が来たら on_wait(0) を呼ぶ）
+        request_context:    送信〜ステータス確認を囲むコンテキストマネージャー（スピナー表示など）
+        on_token:           streaming のとき、届いた answer の累積テキストを渡して呼ぶ
+        on_conversation_id: 会話IDが分かった時点で呼ぶ（streaming なら最初のイベント）
+        """
+        conversation_id = None
+        dropped_cid = None
+        try:
+            waiting_since = time.perf_counter()
+            with governor.slot(on_wait=on_wait) if governor is not None else nullcontext():
+                trace.add("dify_queue", time.perf_counter() - waiting_since)
+                if on_wait is not None:
+                    on_wait(0)
+                with request_context or nullcontext():
+                    # --- 400 対策：会話IDが原因っぽいときだけ1回だけフォールバック（再送だけの時間を記録） ---
+                    with trace.span("dify_request"):
+                        res, dropped_cid = post_with_cid_fallback(
+                            client, payload, on_resend=lambda seconds: trace.add("cid_fallback", seconds)
+                        )
+                    res.raise_for_status()
+
+                if payload["response_mode"] == "streaming":
+                    with trace.span("dify_stream"):
+                        answer, conversation_id = stream_dify_answer(
+                            res, on_token=on_token, on_conversation_id=on_conversation_id
+                        )
+                    answer = answer or NO_ANSWER
+                else:
+                    with trace.span("dify_response"):
+                        rj = res.json()
+                    answer = rj.get("answer", NO_ANSWER)
+                    conversation_id = rj.get("conversation_id")
+                    if conversation_id and on_conversation_id is not None:
+                        on_conversation_id(conversation_id)
+        except Exception as e:
+            # HTTPエラー（本文付き）/ストリーミング/通信/不明なエラーを種類ごとの文面にする
+            return TurnResult(describe_error(e), conversation_id or payload.get("conversation_id"), e, dropped_cid)
+        return TurnResult(answer, conversation_id or payload.get("conversation_id"), None, dropped_cid)
+
+    def close(self):
+        self.log_executor.shutdown()
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""アップロードCSVの読み込み（チャンク単位）と、チャット添付用のコンパクトな表現"""
+import csv
+import io
+import math
+
+# numpy / pandas は CSV を初めて読むときに読み込む（起動を速くするため）
+
+PREVIEW_ROWS = 10
+SAMPLE_ROWS = 500           # 添付候補として保持するランダムサンプルの行数
+MAX_TRACKED_VALUES = 200    # これを超える種類の値がある列はカテゴリ扱いしない
+TOP_VALUES = 8              # 列の要約に載せる頻出値の数
+DEFAULT_TOKEN_BUDGET = 3000
+CELL_LIMITS = (200, 100, 60, 30, 15)
+MIN_SAMPLE_ROWS = 30        # この行数が入るまでセルの切り詰めを強める
+
+
+def read_header(data: bytes):
+    """CSV の列名だけを読む"""
+    import pandas as pd
+
+    return list(pd.read_csv(io.BytesIO(data), nrows=0).columns)
+
+
+def summarize_csv(data: bytes, usecols=None, nrows=None, chunksize=50_000,
+                  sample_rows=SAMPLE_ROWS, seed=0):
+    """CSV をチャンクごとに読み、全体は保持せずに要約だけを返す。
+
+    戻り値の dict:
+      rows / columns / dtypes: 行数・列名・推定した型（全チャンクで数値なら数値型）
+      preview:  先頭 PREVIEW_ROWS 行（表示用）
+      sample:   全行からの一様ランダムサンプル（最大 sample_rows 行、元の行順）
+      values:   カテゴリ列の 値 -> 出現数（種類が多すぎる列は None）
+      stats:    列ごとの非欠損数・最小・最大・平均（数値列のみ）の DataFrame
+    """
+    import numpy as np
+    import pandas as pd
+
+    reader = pd.read_csv(
+        io.BytesIO(data),
+        usecols=list(usecols) if usecols else None,
+        nrows=nrows,
+        chunksize=chunksize,
+    )
+    rng = np.random.default_rng(seed)
+
+    rows = 0
+    head = None
+    sample = None
+    columns = None
+    dtypes = {}
+    non_null = {}
+    num = {}     # 数値列の 列名 -> [count, sum, min, max]（途中で数値以外が出たら除外）
+    values = {}  # 非数値列の 列名 -> {値: 出現数} / None
+    for chunk in reader:
+        if columns is None:
+            columns = list(chunk.columns)
+            dtypes = {c: str(chunk[c].dtype) for c in columns}
+            non_null = {c: 0 for c in columns}
+            num = {c: [0, 0.0, None, None] for c in columns if pd.api.types.is_numeric_dtype(chunk[c].dtype)}
+            values = {c: {} for c in columns if c not in num}
+        if head is None or len(head) < PREVIEW_ROWS:
+            part = chunk.head(PREVIEW_ROWS - (0 if head is None else len(head)))
+            head = part if head is None else pd.concat([head, part])
+
+        # bottom-k サンプリング: 各行に乱数キーを振り、全体でキーが小さい k 行を残す
+        keyed = chunk.assign(_key=rng.random(len(chunk)))
+        sample = keyed if sample is None else pd.concat([sample, keyed])
+        if len(sample) > sample_rows:
+            sample = sample.nsmallest(sample_rows, "_key")
+
+        rows += len(chunk)
+        counts = chunk.notna().sum()
+        for c in columns:
+            non_null[c] += int(counts[c])
+            col = chunk[c]
+            if c in num and not pd.api.types.is_numeric_dtype(col.dtype):
+                num.pop(c)
+                values[c] = None  # 途中まで数えていないので頻出値は出さない
+                dtypes[c] = str(col.dtype)
+            if c in num:
+                if col.dtype.kind == "f" and dtypes[c] != str(col.dtype):
+                    dtypes[c] = str(col.dtype)  # 欠損を含むチャンクで int → float になった場合
+                valid = col.dropna()
+                if valid.empty:
+                    continue
+                acc = num[c]
+                acc[0] += len(valid)
+                acc[1] += float(valid.sum())
+                lo, hi = valid.min(), valid.max()
+                acc[2] = lo if acc[2] is None else min(acc[2], lo)
+                acc[3] = hi if acc[3] is None else max(acc[3], hi)
+            elif values.get(c) is not None:
+                seen = values[c]
+                for v, n in col.dropna().astype(str).value_counts().items():
+                    seen[v] = seen.get(v, 0) + int(n)
+                if len(seen) > MAX_TRACKED_VALUES:
+                    values[c] = None
+
+    if columns is None:
+        columns = read_header(data)
+        dtypes = {c: "object" for c in columns}
+        non_null = {c: 0 for c in columns}
+        values = {c: {} for c in columns}
+        head = pd.DataFrame(columns=columns)
+        sample = pd.DataFrame(columns=columns + ["_key"])
+
+    stats = pd.DataFrame([
+        {
+            "column": c,
+            "dtype": dtypes[c],
+            "non_null": non_null[c],
+            "min": num[c][2] if c in num else None,
+            "max": num[c][3] if c in num else None,
+            "mean": (num[c][1] / num[c][0]) if c in num and num[c][0] else None,
+        }
+        for c in columns
+    ])
+
+    return {
+        "rows": rows,
+        "columns": columns,
+        "dtypes": dtypes,
+        "preview": head.reset_index(drop=True),
+        "sample": sample.sort_index().drop(columns="_key"),
+        "values": {c: values.get(c) for c in columns if c not in num},
+        "stats": stats,
+    }
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の目安（ASCII は約4文字で1トークン、日本語などは1文字1トークン）"""
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+
+def _clip(value, limit: int) -> str:
+    s = "" if value is None or (isinstance(value, float) and math.isnan(value)) else str(value)
+    s = " ".join(s.split())  # 改行・連続空白を詰める
+    return s if len(s) <= limit else s[: limit - 1] + "…"
+
+
+def _format_number(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return "-"
+    return f"{v:.4g}" if isinstance(v, float) else str(v)
+
+
+def _column_lines(summary):
+    """列ごとの要約行。値が1種類しかない列は行サンプルから外せるよう集合で返す"""
+    lines = []
+    constant = set()
+    stats = summary["stats"].set_index("column")
+    for c in summary["columns"]:
+        st_ = stats.loc[c]
+        line = f"- {_clip(c, 40)} [{st_['dtype']}] 非欠損={int(st_['non_null'])}"
+        if c in summary["values"]:
+            seen = summary["values"][c]
+            if seen is None:
+                line += " 値の種類=多数"
+            else:
+                top = sorted(seen.items(), key=lambda kv: -kv[1])[:TOP_VALUES]
+                line += f" 値の種類={len(seen)}"
+                if top:
+                    line += " 頻出: " + ", ".join(f"{_clip(v, 30)}({n})" for v, n in top)
+                if len(seen) == 1:
+                    constant.add(c)
+        else:
+            line += (f" 最小={_format_number(st_['min'])} 最大={_format_number(st_['max'])}"
+                     f" 平均={_format_number(st_['mean'])}")
+        lines.append(line)
+    return lines, constant
+
+
+def encode_for_budget(summary, token_budget=DEFAULT_TOKEN_BUDGET):
+    """要約を token_budget（目安）に収まるテキストにする。(text, info) を返す。
+
+    1. 全体の行数・列数と、列ごとの型/統計/頻出値（カテゴリ値は重複させず一覧で）
+    2. ランダムサンプル行を CSV で。値が1種類の列は省き、セルを切り詰めて予算内に収める
+    info: tokens / chars / budget / sample_rows / cell_limit
+    """
+    import numpy as np
+
+    col_lines, constant = _column_lines(summary)
+    header = [f"# CSV 全{summary['rows']}行 × {len(summary['columns'])}列", "## 列の要約", *col_lines]
+    text = "\n".join(header)
+    used = estimate_tokens(text)
+    if used > token_budget:
+        # 列の要約だけで予算超過: 入るところまでで打ち切る
+        kept = header[:3]
+        used = estimate_tokens("\n".join(kept))
+        for line in header[3:]:
+            cost = estimate_tokens(line) + 1
+            if used + cost > token_budget:
+                break
+            kept.append(line)
+            used += cost
+        text = "\n".join(kept)
+        return text, {"tokens": used, "chars": len(text), "budget": token_budget, "sample_rows": 0, "cell_limit": 0}
+
+    sample = summary["sample"]
+    row_cols = [c for c in summary["columns"] if c not in constant]
+    records = sample[row_cols].to_numpy(dtype=object) if row_cols else np.empty((0, 0), dtype=object)
+    title = f"\n## ランダムサンプル {len(sample)}行（全{summary['rows']}行から抽出、元の行順）\n"
+
+    best = ("", 0, 0)
+    for limit in CELL_LIMITS:
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow([_clip(c, limit) for c in row_cols])
+        body = buf.getvalue()
+        budget_left = token_budget - used - estimate_tokens(title)
+        cost = estimate_tokens(body)
+        included = 0
+        for rec in records:
+            buf = io.StringIO()
+            csv.writer(buf, lineterminator="\n").writerow([_clip(v, limit) for v in rec])
+            line = buf.getvalue()
+            line_cost = estimate_tokens(line)
+            if cost + line_cost > budget_left:
+                break
+            body += line
+            cost += line_cost
+            included += 1
+        if included > best[1] or not best[0]:
+            best = (body, included, limit)
+        if included >= min(len(records), MIN_SAMPLE_ROWS):
+            break
+
+    body, included, limit = best
+    if included:
+        title = f"\n## ランダムサンプル {included}行（全{summary['rows']}行から抽出、元の行順）\n"
+        text += title + body.rstrip("\n")
+    return text, {
+        "tokens": estimate_tokens(text),
+        "chars": len(text),
+        "budget": token_budget,
+        "sample_rows": included,
+        "cell_limit": limit if included else 0,
+    }
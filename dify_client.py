@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Dify Chat API クライアント（keep-alive のコネクションプール + 再試行ポリシー）"""
+import hashlib
+import json
+import random
+import re
+import time
+
+# requests は最初の送信時に読み込む（ログイン画面の表示を待たせない）
+
+DEFAULT_CHAT_URL = "https://api.dify.ai/v1/chat-messages"
+# サーバーがメッセージを受け付けずに断ったことを示すステータス（レート制限・一時的な受付停止）。
+# 502/504 はゲートウェイが諦めただけで Dify は処理を続けている場合があり、再送すると
+# 同じ発言が会話に二重に入り得るので含めない
+RETRYABLE_STATUS = (429, 503)
+# 400 の本文にこれらの語が含まれていたら会話IDが原因とみなす
+CID_ERROR_HINTS = ("conversation", "invalid id", "must not be empty")
+
+
+class DifyStreamError(Exception):
+    """SSE の error イベントで通知されたエラー"""
+
+
+def _iter_sse_events(res):
+    """SSE レスポンスの `data:` 行を JSON として順に返す（ping 等の空行は読み飛ばす）"""
+    # text/event-stream は charset 無指定だと ISO-8859-1 扱いになり日本語が化けるため明示
+    res.encoding = "utf-8"
+    for line in res.iter_lines(decode_unicode=True):
+        if not line or not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if not data:
+            continue
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+def stream_dify_answer(res, on_token=None, on_conversation_id=None):
+    """Dify の streaming 応答を読み切り、(answer, conversation_id) を返す。
+
+    - message / agent_message: answer の断片を連結し on_token(累積テキスト) を呼ぶ
+    - message_replace: それまでの answer を置き換える（モデレーション等）
+    - message_end: 終了（接続をプールに戻すためストリームは最後まで読む）
+    - error: DifyStreamError を送出
+    message_end が届く前にストリームが終わった場合（途中で接続を閉じられた場合）も、途中までの
+    answer を完全な回答として扱わないよう DifyStreamError を送出する。
+    """
+    answer = ""
+    conversation_id = None
+    ended = False
+    for ev in _iter_sse_events(res):
+        if conversation_id is None and ev.get("conversation_id"):
+            conversation_id = ev["conversation_id"]
+            if on_conversation_id:
+                on_conversation_id(conversation_id)
+
+        event = ev.get("event")
+        if ended:
+            continue
+        if event in ("message", "agent_message"):
+            answer += ev.get("answer") or ""
+            if on_token:
+                on_token(answer)
+        elif event == "message_replace":
+            answer = ev.get("answer") or ""
+            if on_token:
+                on_token(answer)
+        elif event == "message_end":
+            ended = True
+        elif event == "error":
+            raise DifyStreamError(f"{ev.get('status', '')} {ev.get('code', '')}: {ev.get('message', '')}".strip())
+    if not ended:
+        raise DifyStreamError(f"応答の途中でストリームが終了しました（受信済み {len(answer)} 文字）")
+    return answer, conversation_id
+
+
+def dify_user_id(raw_name: str) -> str:
+    """表示名→英数字・短めの安定IDに正規化（表示名自体はUI表示に使い、APIには安定IDを渡す）"""
+    raw_name = raw_name or "guest"
+    return re.sub(r'[^A-Za-z0-9_-]', '_', raw_name).strip('_')[:64] or hashlib.md5(raw_name.encode()).hexdigest()[:16]
+
+def conversation_id_rejected(res) -> bool:
+    """400 応答の原因が会話IDらしいか"""
+    if res.status_code != 400:
+        return False
+    try:
+        errj = res.json()
+        emsg = (errj.get("message") or errj.get("error") or errj.get("detail") or "")
+    except Exception:
+        emsg = res.text
+    return any(k in str(emsg).lower() for k in CID_ERROR_HINTS)
+
+def post_with_cid_fallback(client, payload, on_resend=None):
+    """送信し、400 が会話ID起因なら conversation_id を外して1回だけ再送する。
+
+    (Response, 外した会話ID or None) を返す。payload から conversation_id が取り除かれることがある。
+    on_resend: 再送したとき、再送にかかった秒数を渡して呼ぶ（処理時間の計測用）
+    """
+    res = client.chat_messages(payload)
+    if payload.get("conversation_id") and conversation_id_rejected(res):
+        bad_cid = payload.pop("conversation_id")
+        res.close()
+        started = time.perf_counter()
+        res = client.chat_messages(payload)
+        if on_resend is not None:
+            on_resend(time.perf_counter() - started)
+        return res, (bad_cid if res.ok else None)
+    return res, None
+
+def _connection_not_established(e) -> bool:
+    """接続を確立できなかった（＝リクエストを送っていない）ConnectionError か。
+
+    接続後に切られた "Connection aborted" / RemoteDisconnected は、サーバーが受け取って
+    処理した可能性があるので含めない。
+    """
+    import requests
+    from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None  # MaxRetryError.reason
+    return isinstance(reason, (ConnectTimeoutError, NewConnectionError))
+
+def describe_error(e) -> str:
+    """チャット欄・ログに残すエラーメッセージ"""
+    import requests
+
+    if isinstance(e, requests.exceptions.HTTPError):
+        # エラーメッセージ本文をそのまま表示（原因の特定に有効）
+        body_text = getattr(e.response, "text", "(レスポンスボディ取得不可)")
+        return f"⚠️ APIリクエストでHTTPエラーが発生しました (ステータスコード: {e.response.status_code})\n\n```\n{body_text}\n```"
+    if isinstance(e, DifyStreamError):
+        return f"⚠️ 応答のストリーミング中にエラーが発生しました: {e}"
+    if isinstance(e, requests.exceptions.RequestException):
+        return f"⚠️ APIリクエストで通信エラーが発生しました: {e}"
+    return f"⚠️ 不明なエラーが発生しました: {e}"
+
+
+class DifyClient:
+    """API キー単位で requests.Session を保持し、TCP/TLS 接続を使い回す。
+
+    再試行するのは「サーバーがリクエストを処理していない」と判断できる失敗だけ:
+    接続確立の失敗/タイムアウトと 429/503。/chat-messages は冪等でない POST なので、
+    読み取りタイムアウト、送信後に接続を切られた場合（Connection aborted など）、502/504 は
+    二重投稿になり得るので再試行しない。待ち時間は full jitter の指数バックオフ
+    （Retry-After があればそちらを優先）。
+    """
+
+    def __init__(self, api_key, chat_url, pool_maxsize=10, connect_timeout=5.0, read_timeout=60.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0):
+        self.api_key = api_key
+        self.chat_url = chat_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Content-Type は json= が自動付与
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+
+    def _backoff(self, attempt, res=None):
+        retry_after = res.headers.get("Retry-After") if res is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def chat_messages(self, payload):
+        """/chat-messages に POST して Response を返す（streaming のときは stream=True で返す）"""
+        import requests
+
+        stream = payload.get("response_mode") == "streaming"
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                res = self.session.post(self.chat_url, json=payload, timeout=self.timeout, stream=stream)
+            except requests.exceptions.ConnectionError as e:
+                if last or not _connection_not_established(e):
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+
+            if res.status_code in RETRYABLE_STATUS and not last:
+                wait = self._backoff(attempt, res)
+                res.close()
+                time.sleep(wait)
+                continue
+            return res
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""同じ質問を複数ペルソナへ並列に送る（ファンアウト）"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from chat_turn import NO_ANSWER, build_payload
+from dify_client import describe_error, post_with_cid_fallback
+
+
+def ask_persona(client, query, user_id, conversation_id=None, inputs=None, slot=None, cache=None):
+    """1ペルソナに blocking モードで質問する。ワーカースレッドから呼ぶので Streamlit API は使わない。
+
+    slot:  送信の前後を囲むコンテキストマネージャー（Governor.slot() や Semaphore で流量を制御）
+    cache: AnswerCache（バッチ実行の --dedupe 用）。会話IDが無い（文脈のない）質問のときだけ参照・保存する。
+           同じ質問が同時に来たら1つだけ送り、残りはその回答を待って使う。
+           slot の順番待ちの間に回答が入ることもあるので、slot に入った後にも見直す。
+           キャッシュから返した回答は Dify の会話を作らないので conversation_id は None になる。
+           続きの質問をする画面（チャット・同時質問）では会話IDが必要なので渡さないこと
+
+    戻り値の dict: answer / conversation_id / error（成功時 None）/ dropped_cid / elapsed（秒）/ cached
+    """
+    payload = build_payload(query, user_id, "blocking", conversation_id, inputs)
+
+    started = time.monotonic()
+
+    def from_cache(answer):
+        return {
+            "answer": answer,
+            "conversation_id": None,
+            "error": None,
+            "dropped_cid": None,
+            "elapsed": time.monotonic() - started,
+            "cached": True,
+        }
+
+    cache_key = None
+    if cache is not None and not conversation_id:
+        cache_key = cache.make_key(client.api_key, query, payload["inputs"])
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return from_cache(cached)
+
+    try:
+        # 同じ質問を問い合わせ中のスレッドがあれば、その回答が入るまで（slot を取らずに）待つ
+        with cache.single_flight(cache_key) if cache_key else nullcontext():
+            with slot or nullcontext():
+                # 待っている間に、先に送られた同じ質問の回答が入っていれば送らない
+                cached = cache.get(cache_key, count_miss=False) if cache_key else None
+                if cached is not None:
+                    return from_cache(cached)
+                res, dropped_cid = post_with_cid_fallback(client, payload)
+                res.raise_for_status()
+                rj = res.json()
+            if cache_key and rj.get("answer"):
+                cache.put(cache_key, rj["answer"])
+        return {
+            "answer": rj.get("answer") or NO_ANSWER,
+            "conversation_id": rj.get("conversation_id") or payload.get("conversation_id"),
+            "error": None,
+            "dropped_cid": dropped_cid,
+            "elapsed": time.monotonic() - started,
+            "cached": False,
+        }
+    except Exception as e:
+        return {
+            "answer": describe_error(e),
+            "conversation_id": payload.get("conversation_id"),
+            "error": e,
+            "dropped_cid": None,
+            "elapsed": time.monotonic() - started,
+            "cached": False,
+        }
+
+
+def fan_out(tasks, max_workers=None):
+    """tasks: {キー: 引数なしの呼び出し}。完了した順に (キー, 結果) を返すジェネレーター"""
+    if not tasks:
+        return
+    with ThreadPoolExecutor(max_workers=max_workers or len(tasks), thread_name_prefix="persona-fanout") as pool:
+        futures = {pool.submit(fn): key for key, fn in tasks.items()}
+        for fut in as_completed(futures):
+            yield futures[fut], fut.result()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""chat_logs ワークシートの conversation_id → 行番号 インデックス（差分更新）"""
+import threading
+import time
+from contextlib import nullcontext
+
+
+def col_letter(n: int) -> str:
+    """1始まりの列番号を A1 表記の列名に変換する（1→A, 27→AA）"""
+    letters = ""
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord("A") + rem) + letters
+    return letters
+
+
+def _to_ranges(row_numbers):
+    """昇順の行番号リストを連続区間 [(start, end), ...] にまとめる"""
+    ranges = []
+    for r in row_numbers:
+        if ranges and r == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], r)
+        else:
+            ranges.append((r, r))
+    return ranges
+
+
+class SheetHistoryIndex:
+    """ログシートの会話ID列だけを差分で読み、会話ごとの行番号を保持する。
+
+    - refresh(): 前回読んだ最終行より後ろの会話ID列だけを取得してインデックスに追加
+    - rows_for(cid): その会話の行だけを範囲読み込み（batch_get）で取得
+    ログは追記のみの前提なので、一度読んだ行の内容もキャッシュして再利用する。
+    limiter（rate_limit.Governor）を渡すと Sheets API の呼び出しをその枠内で行う。
+    metrics（metrics.LatencyStats）を渡すと読み込みにかかった時間を "sheets_read" として記録する。
+    """
+
+    def __init__(self, worksheet, min_refresh_interval=5.0, limiter=None, metrics=None):
+        self._ws = worksheet
+        self.min_refresh_interval = min_refresh_interval
+        self._limiter = limiter
+        self._metrics = metrics
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        """インデックスを破棄する（シートの行を手で削除した場合など）"""
+        with self._lock:
+            self._header = None
+            self._cid_col = None
+            self._last_row = 1          # 読み込み済みの最終行（1 = ヘッダー行）
+            self._index = {}            # conversation_id -> [行番号, ...]
+            self._rows = {}             # 行番号 -> 行の値
+            self._refreshed_at = 0.0
+
+    def _call(self, fn, *args):
+        with self._metrics.timer("sheets_read") if self._metrics else nullcontext():
+            return self._limiter.call(fn, *args) if self._limiter else fn(*args)
+
+    @property
+    def header(self):
+        return list(self._header or [])
+
+    @property
+    def last_row(self) -> int:
+        return self._last_row
+
+    def _load_header(self):
+        header = self._call(self._ws.row_values, 1)
+        if "conversation_id" not in header:
+            raise ValueError("chat_logs シートのヘッダーに conversation_id 列がありません。")
+        self._header = header
+        self._cid_col = header.index("conversation_id") + 1
+
+    def refresh(self, force=False):
+        """最終行より後ろに追記された行をインデックスに取り込む"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._header is not None and now - self._refreshed_at < self.min_refresh_interval:
+                return
+            if self._header is None:
+                self._load_header()
+
+            col = col_letter(self._cid_col)
+            start = self._last_row + 1
+            values = self._call(self._ws.get, f"{col}{start}:{col}")
+            for offset, cell in enumerate(values):
+                cid = cell[0] if cell else ""
+                if cid:
+                    self._index.setdefault(cid, []).append(start + offset)
+            self._last_row += len(values)
+            self._refreshed_at = now
+
+    def row_numbers(self, conversation_id: str):
+        """会話IDに属する行番号（refresh 済みの範囲）"""
+        with self._lock:
+            return list(self._index.get(conversation_id, []))
+
+    def rows_for(self, conversation_id: str):
+        """会話IDに属する行を {列名: 値} の dict のリストで返す（シート上の順）"""
+        with self._lock:
+            self.refresh()
+            row_numbers = self._index.get(conversation_id, [])
+            missing = [r for r in row_numbers if r not in self._rows]
+            if missing:
+                last_col = col_letter(len(self._header))
+                ranges = _to_ranges(missing)
+                results = self._call(self._ws.batch_get, [f"A{s}:{last_col}{e}" for s, e in ranges])
+                for (s, e), values in zip(ranges, results):
+                    for offset in range(e - s + 1):
+                        self._rows[s + offset] = list(values[offset]) if offset < len(values) else []
+
+            width = len(self._header)
+            out = []
+            for r in row_numbers:
+                values = self._rows[r]
+                values = values + [""] * (width - len(values))
+                out.append(dict(zip(self._header, values)))
+            return out
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""全会話の assistant 回答のキーワード集計（ローカル SQLite 上で追記分だけ差分更新）"""
+import sqlite3
+import threading
+
+# キーワード分割（utils._split_keywords）と同じく、改行で区切って前後の空白を除いた非空の行をキーワードとする
+_LINE_BREAK = r"\r\n|\r|\n"
+
+_SCHEMA = """
+-- 回答（chat_logs の行）ごとのキーワード。共起の計算に使う
+CREATE TABLE IF NOT EXISTS kw_answers (
+    keyword  TEXT NOT NULL,
+    row_id   INTEGER NOT NULL,
+    bot_type TEXT NOT NULL,
+    PRIMARY KEY (keyword, row_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_kw_answers_row ON kw_answers (row_id);
+-- ペルソナ × キーワード の出現回答数
+CREATE TABLE IF NOT EXISTS kw_counts (
+    bot_type TEXT NOT NULL,
+    keyword  TEXT NOT NULL,
+    answers  INTEGER NOT NULL,
+    PRIMARY KEY (bot_type, keyword)
+) WITHOUT ROWID;
+-- 日 × ペルソナ × キーワード の出現回答数（推移用）
+CREATE TABLE IF NOT EXISTS kw_daily (
+    day      TEXT NOT NULL,
+    bot_type TEXT NOT NULL,
+    keyword  TEXT NOT NULL,
+    answers  INTEGER NOT NULL,
+    PRIMARY KEY (keyword, day, bot_type)
+) WITHOUT ROWID;
+-- ペルソナごとの集計済み回答数
+CREATE TABLE IF NOT EXISTS kw_personas (
+    bot_type TEXT PRIMARY KEY,
+    answers  INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kw_state (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_DAY = r"^(\d{4}-\d{2}-\d{2})"  # ISO 形式のタイムスタンプ（UTC で保存）の日付部分
+
+_UPSERT = "INSERT INTO {table} ({cols}, answers) VALUES ({marks}, ?) " \
+          "ON CONFLICT DO UPDATE SET answers = answers + excluded.answers"
+
+
+def _records(frame, columns):
+    """DataFrame の列を executemany 用のタプル列にする（列ごとに一括で Python 値へ変換）"""
+    return list(zip(*(frame[c].tolist() for c in columns)))
+
+
+def _persona_filter(bot_types, column="bot_type"):
+    if not bot_types:
+        return "", []
+    return f" AND {column} IN ({', '.join('?' * len(bot_types))})", list(bot_types)
+
+
+class KeywordStats:
+    """chat_logs（ChatLogStore と同じ SQLite ファイル）の assistant 行からキーワード集計を作る。
+
+    update() は前回処理した行ID（透かし）より後ろの行だけをまとめて分割・集計し、集計表に加算する。
+    集計値はいずれも「そのキーワードを含む回答の数」（1つの回答で同じ行が複数あっても1と数える）。
+    """
+
+    WATERMARK = "last_row_id"
+
+    def __init__(self, path, chunk_rows=20_000):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @property
+    def watermark(self) -> int:
+        row = self._conn().execute("SELECT value FROM kw_state WHERE key = ?", (self.WATERMARK,)).fetchone()
+        return row[0] if row else 0
+
+    # ---- 差分更新 ----
+    def update(self) -> int:
+        """追記された assistant 行を集計に加える。加えた回答数を返す"""
+        added = 0
+        with self._lock:
+            while True:
+                n = self._update_chunk()
+                added += n
+                if n < self.chunk_rows:
+                    return added
+
+    def _update_chunk(self) -> int:
+        import pandas as pd
+
+        conn = self._conn()
+        with conn:
+            # 透かしの読み取りから書き込みまでを1トランザクションに（複数プロセスで二重加算しない）
+            conn.execute("BEGIN IMMEDIATE")
+            last = self.watermark
+            rows = conn.execute(
+                "SELECT id, bot_type, timestamp, content FROM chat_logs "
+                "WHERE id > ? AND role = 'assistant' ORDER BY id LIMIT ?",
+                (last, self.chunk_rows),
+            ).fetchall()
+            if not rows:
+                # assistant 以外の行だけが増えた場合も、次回読み飛ばせるよう透かしを進める
+                top = conn.execute("SELECT MAX(id) FROM chat_logs").fetchone()[0] or 0
+                if top > last:
+                    self._set_watermark(conn, top)
+                return 0
+
+            df = pd.DataFrame(rows, columns=["row_id", "bot_type", "timestamp", "content"])
+            df["day"] = df["timestamp"].str.extract(_DAY, expand=False).fillna("")
+            kw = (df.assign(keyword=df["content"].str.split(_LINE_BREAK, regex=True))
+                    .explode("keyword")[["keyword", "row_id", "bot_type", "day"]])
+            kw["keyword"] = kw["keyword"].str.strip()
+            kw = (kw[kw["keyword"].notna() & (kw["keyword"] != "")]
+                  .drop_duplicates(["keyword", "row_id"])
+                  .sort_values(["keyword", "row_id"]))  # 主キー順に入れると B-tree への挿入が速い
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO kw_answers (keyword, row_id, bot_type) VALUES (?, ?, ?)",
+                _records(kw, ["keyword", "row_id", "bot_type"]),
+            )
+            for table, keys, frame in (
+                ("kw_counts", ["bot_type", "keyword"], kw),
+                ("kw_daily", ["keyword", "day", "bot_type"], kw),
+                ("kw_personas", ["bot_type"], df),
+            ):
+                # groupby の結果は keys（＝各表の主キー）順に並ぶ
+                grouped = frame.groupby(keys).size().reset_index(name="answers")
+                conn.executemany(
+                    _UPSERT.format(table=table, cols=", ".join(keys), marks=", ".join("?" * len(keys))),
+                    _records(grouped, keys + ["answers"]),
+                )
+            self._set_watermark(conn, int(df["row_id"].iloc[-1]))
+            return len(df)
+
+    def _set_watermark(self, conn, row_id):
+        conn.execute(
+            "INSERT INTO kw_state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (self.WATERMARK, row_id),
+        )
+
+    def rebuild(self) -> int:
+        """集計を捨てて全行から作り直す（キーワードの定義を変えた場合など）"""
+        conn = self._conn()
+        with self._lock, conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table in ("kw_answers", "kw_counts", "kw_daily", "kw_personas", "kw_state"):
+                conn.execute(f"DELETE FROM {table}")
+        return self.update()
+
+    # ---- 読み出し ----
+    def personas(self) -> dict:
+        """ペルソナ -> 集計済みの回答数"""
+        return dict(self._conn().execute("SELECT bot_type, answers FROM kw_personas ORDER BY bot_type"))
+
+    def top_keywords(self, bot_types=None, limit=30):
+        """[(キーワード, 回答数), ...]（回答数の多い順）"""
+        where, params = _persona_filter(bot_types)
+        return self._conn().execute(
+            f"SELECT keyword, SUM(answers) AS n FROM kw_counts WHERE 1 = 1{where} "
+            "GROUP BY keyword ORDER BY n DESC, keyword LIMIT ?",
+            params + [limit],
+        ).fetchall()
+
+    def by_persona(self, keywords, bot_types=None):
+        """[(ペルソナ, キーワード, 回答数), ...]"""
+        if not keywords:
+            return []
+        where, params = _persona_filter(bot_types)
+        return self._conn().execute(
+            f"SELECT bot_type, keyword, answers FROM kw_counts "
+            f"WHERE keyword IN ({', '.join('?' * len(keywords))}){where}",
+            list(keywords) + params,
+        ).fetchall()
+
+    def trend(self, keywords, bot_types=None):
+        """[(日, キーワード, 回答数), ...]（日付の分からない行は除く）"""
+        if not keywords:
+            return []
+        where, params = _persona_filter(bot_types)
+        return self._conn().execute(
+            f"SELECT day, keyword, SUM(answers) FROM kw_daily "
+            f"WHERE keyword IN ({', '.join('?' * len(keywords))}) AND day != ''{where} "
+            "GROUP BY day, keyword ORDER BY day",
+            list(keywords) + params,
+        ).fetchall()
+
+    def cooccurring(self, keyword, bot_types=None, limit=20):
+        """keyword と同じ回答に出てくるキーワード [(キーワード, 回答数), ...]"""
+        where, params = _persona_filter(bot_types, column="a.bot_type")
+        return self._conn().execute(
+            "SELECT b.keyword, COUNT(*) AS n FROM kw_answers a "
+            "JOIN kw_answers b ON b.row_id = a.row_id AND b.keyword != a.keyword "
+            f"WHERE a.keyword = ?{where} GROUP BY b.keyword ORDER BY n DESC, b.keyword LIMIT ?",
+            [keyword] + params + [limit],
+        ).fetchall()
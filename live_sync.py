@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""共有会話のライブ同期: 表示中の会話についてシートの新しい行だけをローカルへ取り込むポーラー"""
+import threading
+import time
+
+
+class LiveSyncHub:
+    """プロセス全体で1つ持ち、表示中（購読中）の会話の新しい行をローカルの SQLite に集める。
+
+    - subscribe(cid): セッションがその会話を表示中であることを知らせる（表示の更新ごとに呼ぶ）。
+      idle_timeout 秒呼ばれなかった会話はポーリングをやめる
+    - ポーラーは interval 秒ごとに SheetHistoryIndex で会話ID列の追記分だけを読み、購読中の会話に
+      新しい行があればその行だけを取得して取り込む。購読しているセッションが何人いても、
+      シートの読み込みはプロセスあたり1回で済む
+    - 各セッションは ChatLogStore.rows_after(cid, 透かし) で自分の透かしより新しい行だけを受け取る
+    get_index は SheetHistoryIndex を返す関数。ポーリングのたびに呼ぶので、シートを開けずに例外に
+    なっても、間隔を空けて（失敗のたびに倍）次のポーリングで開き直す。
+    get_index が None（Sheets 未設定）の場合はポーラーを動かさず、同じプロセスの SQLite だけで共有する。
+    """
+
+    def __init__(self, store, get_index=None, interval=2.0, idle_timeout=30.0, max_backoff=60.0):
+        self.store = store
+        self._get_index = get_index
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._subscribers = {}  # conversation_id -> 最後に subscribe された時刻
+        self._imported = {}     # conversation_id -> 取り込み済みのシート上の行数
+        self._thread = None
+        self._stop = threading.Event()
+        self.polls = 0
+        self.imported = 0
+        self.last_error = None
+
+    def subscribe(self, conversation_id: str):
+        if not conversation_id:
+            return
+        with self._lock:
+            self._subscribers[conversation_id] = time.monotonic()
+            if self._get_index is not None and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-sync", daemon=True)
+                self._thread.start()
+
+    def active(self):
+        """購読中の会話ID（期限切れの購読はここで外す）"""
+        now = time.monotonic()
+        with self._lock:
+            for cid, seen in list(self._subscribers.items()):
+                if now - seen > self.idle_timeout:
+                    del self._subscribers[cid]
+            return list(self._subscribers)
+
+    def close(self):
+        self._stop.set()
+
+    def poll_once(self):
+        """シートの追記分を読み、購読中の会話の新しい行をローカルに取り込む。取り込んだ行数を返す"""
+        active = self.active()
+        if not active:
+            return 0
+        index = self._get_index()
+        index.refresh(force=True)
+        self.polls += 1
+        added = 0
+        for cid in active:
+            known = len(index.row_numbers(cid))
+            done = self._imported.get(cid, 0)  # 初回は全行（ローカルに既にある行は一意制約で無視される）
+            if known > done:
+                rows = index.rows_for(cid)[done:]
+                added += self.store.import_rows(rows)
+                self._imported[cid] = known
+        self.imported += added
+        return added
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.wait(self.interval if not attempt else min(self.interval * 2 ** attempt,
+                                                                        self.max_backoff)):
+            try:
+                self.poll_once()
+                self.last_error = None
+                attempt = 0
+            except Exception as e:
+                self.last_error = e
+                attempt += 1
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""チャットログのローカル保存先（SQLite / WAL モード）。Google Sheets はこのミラー"""
+import sqlite3
+import threading
+
+LOG_COLUMNS = ["timestamp", "conversation_id", "bot_type", "role", "name", "content"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_logs (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp       TEXT NOT NULL,
+    conversation_id TEXT NOT NULL,
+    bot_type        TEXT NOT NULL DEFAULT '',
+    role            TEXT NOT NULL DEFAULT '',
+    name            TEXT NOT NULL DEFAULT '',
+    content         TEXT NOT NULL DEFAULT '',
+    synced          INTEGER NOT NULL DEFAULT 0
+);
+-- 会話ごとの時系列読み込み用。シートからの取り込みで同じ行を二重登録しないための一意制約も兼ねる
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_logs_cid_ts
+    ON chat_logs (conversation_id, timestamp, role, name);
+CREATE INDEX IF NOT EXISTS idx_chat_logs_unsynced
+    ON chat_logs (id) WHERE synced = 0;
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ChatLogStore:
+    """SQLite に会話ログを保存する。接続はスレッドごとに持つ（WAL なので読み書きが並行できる）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _values(row):
+        """list（LOG_COLUMNS 順）/ dict のどちらでも列値のタプルにする"""
+        if isinstance(row, dict):
+            return tuple(str(row.get(c, "") or "") for c in LOG_COLUMNS)
+        values = [str(v) if v is not None else "" for v in row]
+        return tuple(values + [""] * (len(LOG_COLUMNS) - len(values)))
+
+    # ---- 書き込み ----
+    def append(self, row) -> int:
+        """アプリで発生した1行を未同期として追加し、行IDを返す"""
+        cols = ", ".join(LOG_COLUMNS)
+        marks = ", ".join("?" * len(LOG_COLUMNS))
+        cur = self._conn().execute(
+            f"INSERT OR IGNORE INTO chat_logs ({cols}, synced) VALUES ({marks}, 0)", self._values(row)
+        )
+        return cur.lastrowid
+
+    def import_rows(self, rows) -> int:
+        """シート由来の行を同期済みとして取り込む（既にある行は無視）。追加件数を返す"""
+        cols = ", ".join(LOG_COLUMNS)
+        marks = ", ".join("?" * len(LOG_COLUMNS))
+        values = [v for v in (self._values(r) for r in rows) if v[1]]
+        if not values:
+            return 0
+        conn = self._conn()
+        before = conn.total_changes
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(f"INSERT OR IGNORE INTO chat_logs ({cols}, synced) VALUES ({marks}, 1)", values)
+        return conn.total_changes - before
+
+    def mark_synced(self, ids):
+        ids = [i for i in ids if i is not None]
+        if not ids:
+            return
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("UPDATE chat_logs SET synced = 1 WHERE id = ?", [(i,) for i in ids])
+
+    # ---- 読み込み ----
+    def history(self, conversation_id: str):
+        """会話の全行を {列名: 値} の dict のリストで返す（時系列順）"""
+        cols = ", ".join(LOG_COLUMNS)
+        cur = self._conn().execute(
+            f"SELECT {cols} FROM chat_logs WHERE conversation_id = ? ORDER BY timestamp, id",
+            (conversation_id,),
+        )
+        return [dict(zip(LOG_COLUMNS, r)) for r in cur.fetchall()]
+
+    def rows_after(self, conversation_id: str, after_id: int = 0):
+        """会話の行のうち行IDが after_id より大きいものを [(id, {列名: 値}), ...] で返す（追加順）"""
+        cols = ", ".join(LOG_COLUMNS)
+        cur = self._conn().execute(
+            f"SELECT id, {cols} FROM chat_logs WHERE conversation_id = ? AND id > ? ORDER BY id",
+            (conversation_id, after_id),
+        )
+        return [(r[0], dict(zip(LOG_COLUMNS, r[1:]))) for r in cur.fetchall()]
+
+    def last_id(self, conversation_id: str) -> int:
+        """会話の最新の行ID（行が無ければ 0）"""
+        cur = self._conn().execute(
+            "SELECT MAX(id) FROM chat_logs WHERE conversation_id = ?", (conversation_id,)
+        )
+        return cur.fetchone()[0] or 0
+
+    def unsynced(self, limit=None):
+        """シートへ未反映の行を [(id, row), ...] で返す"""
+        cols = ", ".join(LOG_COLUMNS)
+        sql = f"SELECT id, {cols} FROM chat_logs WHERE synced = 0 ORDER BY id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [(r[0], list(r[1:])) for r in self._conn().execute(sql).fetchall()]
+
+    def count(self, unsynced_only=False) -> int:
+        sql = "SELECT COUNT(*) FROM chat_logs" + (" WHERE synced = 0" if unsynced_only else "")
+        return self._conn().execute(sql).fetchone()[0]
+
+    # ---- メタ情報（同期の進捗など） ----
+    def get_meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self._conn().execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, str(value)),
+        )
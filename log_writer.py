@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Google Sheets へのログ書き込みをバックグラウンドでまとめて行う write-behind キュー"""
+import atexit
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+def _status_code(exc):
+    """gspread の APIError などから HTTP ステータスを取り出す（無ければ None）"""
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+
+class SheetLogWriter:
+    """行をキューに積み、ワーカースレッドが append_rows で一括追記する。
+
+    - batch_size 行たまるか、最初の行から flush_interval 秒経ったら書き込む
+    - 429/5xx は指数バックオフで再試行（行は失わずに保持し続ける）
+    - それ以外のエラーはそのバッチを破棄し last_error に記録する
+    - プロセス終了時（atexit）に残りを書き出す
+    - 書き込みに成功したら on_written(keys) を呼ぶ（enqueue 時に渡した key のリスト）
+    - limiter（rate_limit.Governor）を渡すと Sheets API の呼び出しをその枠内で行う
+    - metrics（metrics.LatencyStats）を渡すと append_rows の時間を "sheets_append" として記録する
+    """
+
+    def __init__(self, worksheet, batch_size=50, flush_interval=2.0, max_backoff=30.0, on_written=None,
+                 limiter=None, metrics=None):
+        self._ws = worksheet
+        self._on_written = on_written
+        self._limiter = limiter
+        self._metrics = metrics
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+
+        self._queue = queue.Queue()
+        self._pending = []          # 書き込み待ちの (key, row)（再試行中を含む）
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stop = threading.Event()
+
+        self.written = 0
+        self.dropped = 0
+        self.last_error = None
+
+        self._thread = threading.Thread(target=self._run, name="sheet-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---- 呼び出し側 API ----
+    def enqueue(self, row, key=None):
+        """1行をキューに積む（即座に戻る）。key は書き込み完了時に on_written へ渡される"""
+        self._queue.put((key, list(row)))
+        self._idle.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        """まだシートに書かれていない行数"""
+        with self._lock:
+            return self._queue.qsize() + len(self._pending)
+
+    def flush(self, timeout=None) -> bool:
+        """キューが空になるまで待つ。timeout 内に空になれば True"""
+        return self._idle.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """新規受付を止め、残りを書き出してワーカーを終了する"""
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # ---- ワーカー ----
+    def _collect(self):
+        """次のバッチを _pending に集める（サイズ/時間トリガー）"""
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return
+        with self._lock:
+            self._pending.append(first)
+        deadline = time.monotonic() + self.flush_interval
+        while len(self._pending) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                break
+            try:
+                row = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            with self._lock:
+                self._pending.append(row)
+
+    def _drain_queue(self):
+        """終了時: キューの残りをすべて _pending に移す"""
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._pending.append(row)
+
+    def _write_pending(self) -> bool:
+        """_pending を書き込む。再試行すべき失敗なら False"""
+        batch = self._pending[: self.batch_size]
+        try:
+            with self._limiter.slot() if self._limiter else nullcontext():
+                with self._metrics.timer("sheets_append") if self._metrics else nullcontext():
+                    self._ws.append_rows([row for _, row in batch], value_input_option="RAW")
+        except Exception as e:
+            self.last_error = e
+            if _status_code(e) in RETRYABLE_STATUS:
+                return False
+            with self._lock:
+                del self._pending[: len(batch)]
+            self.dropped += len(batch)
+            return True
+        with self._lock:
+            del self._pending[: len(batch)]
+        self.written += len(batch)
+        self.last_error = None
+        if self._on_written:
+            try:
+                self._on_written([key for key, _ in batch])
+            except Exception as e:
+                self.last_error = e
+        return True
+
+    def _run(self):
+        attempt = 0
+        while not self._stop.is_set():
+            if not self._pending:
+                self._collect()
+            if not self._pending:
+                if self._queue.empty():
+                    self._idle.set()
+                continue
+            if self._write_pending():
+                attempt = 0
+            else:
+                attempt += 1
+                self._stop.wait(min(1.5 ** attempt, self.max_backoff))
+
+        # シャットダウン時: 残りを書き出す（再試行は数回まで）
+        self._drain_queue()
+        for attempt in range(5):
+            while self._pending and self._write_pending():
+                pass
+            if not self._pending:
+                break
+            time.sleep(1.5 ** attempt)
+        self._idle.set()
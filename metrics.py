@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""チャット1ターンの処理時間の計測（段階ごとのスパン）と、プロセス全体での集計・書き出し"""
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _quantile(sorted_values, q):
+    """ソート済みの値の q 分位点（線形補間）"""
+    if not sorted_values:
+        return None
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _label(value) -> str:
+    """Prometheus のラベル値のエスケープ"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class LatencyStats:
+    """(段階, ペルソナ) ごとの処理時間を集計する（スレッドセーフ）。
+
+    - 件数・エラー数・合計秒数はプロセス起動からの累計
+    - 分位点（p50/p95/p99）は直近 window 件から計算する
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}  # (stage, persona) -> deque[秒]
+        self._totals = {}   # (stage, persona) -> [件数, エラー数, 合計秒数]
+
+    def record(self, stage, seconds, persona="", error=False):
+        key = (stage, persona or "")
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = collections.deque(maxlen=self.window)
+                self._totals[key] = [0, 0, 0.0]
+            self._samples[key].append(seconds)
+            totals = self._totals[key]
+            totals[0] += 1
+            totals[1] += 1 if error else 0
+            totals[2] += seconds
+
+    @contextmanager
+    def timer(self, stage, persona=""):
+        """with 文の中の処理時間を記録する（例外が出たらエラーとして数える）"""
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - started, persona, error)
+
+    def summary(self) -> list:
+        """段階・ペルソナごとの集計行のリスト（段階名順）"""
+        with self._lock:
+            items = [(key, sorted(self._samples[key]), list(self._totals[key])) for key in self._samples]
+        rows = []
+        for (stage, persona), values, (count, errors, total) in sorted(items):
+            row = {
+                "stage": stage,
+                "persona": persona,
+                "count": count,
+                "errors": errors,
+                "error_rate": errors / count if count else 0.0,
+                "mean": total / count if count else None,
+            }
+            for q in QUANTILES:
+                row[f"p{int(q * 100)}"] = _quantile(values, q)
+            rows.append(row)
+        return rows
+
+    def to_jsonl(self) -> str:
+        """集計を1行1レコードの JSONL にする（書き出し時刻付き）"""
+        now = datetime.now(timezone.utc).isoformat()
+        return "".join(json.dumps({"time": now, **row}, ensure_ascii=False) + "\n" for row in self.summary())
+
+    def to_prometheus(self, prefix="persona_app") -> str:
+        """Prometheus のテキスト形式（summary 型 + エラー数カウンター）"""
+        name = f"{prefix}_stage_seconds"
+        lines = [
+            f"# HELP {name} Time spent in each stage of a chat turn.",
+            f"# TYPE {name} summary",
+        ]
+        errors = [
+            f"# HELP {prefix}_stage_errors_total Stage executions that raised an error.",
+            f"# TYPE {prefix}_stage_errors_total counter",
+        ]
+        for row in self.summary():
+            labels = f'stage="{_label(row["stage"])}",persona="{_label(row["persona"])}"'
+            for q in QUANTILES:
+                value = row[f"p{int(q * 100)}"]
+                if value is not None:
+                    lines.append(f'{name}{{{labels},quantile="{q}"}} {value:.6f}')
+            lines.append(f"{name}_count{{{labels}}} {row['count']}")
+            lines.append(f"{name}_sum{{{labels}}} {row['mean'] * row['count']:.6f}")
+            errors.append(f"{prefix}_stage_errors_total{{{labels}}} {row['errors']}")
+        return "\n".join(lines + errors) + "\n"
+
+    def write_prometheus(self, path, prefix="persona_app"):
+        """node_exporter の textfile collector 向けに書き出す（一時ファイル経由で置き換え）"""
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp, path)
+
+
+class TurnTrace:
+    """1ターン分の段階ごとの処理時間。stats を渡すとプロセス全体の集計にも記録する"""
+
+    def __init__(self, persona="", stats=None):
+        self.persona = persona
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []  # (段階, 秒, エラー有無)
+        self._stats = stats
+        self._started = time.perf_counter()
+
+    def add(self, stage, seconds, error=False):
+        self.spans.append((stage, seconds, error))
+        if self._stats is not None:
+            self._stats.record(stage, seconds, self.persona, error)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.perf_counter()
+        error = False
+        try:
+            yield
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.add(stage, time.perf_counter() - started, error)
+
+    def finish(self, error=False):
+        """ターン全体（"turn"）の時間を記録する"""
+        self.add("turn", time.perf_counter() - self._started, error)
+
+    @property
+    def failed(self) -> bool:
+        return any(error for _, _, error in self.spans)
+
+    def as_row(self) -> dict:
+        """デバッグ表示用の1行（段階名 → ミリ秒。同じ段階が複数回あれば合計）"""
+        row = {"開始": self.started_at.astimezone().strftime("%H:%M:%S"), "ペルソナ": self.persona}
+        for stage, seconds, error in self.spans:
+            row[stage] = row.get(stage, 0) + round(seconds * 1000)
+        row["エラー"] = "あり" if self.failed else ""
+        return row
+
+
+class StartupReport:
+    """プロセス起動後の最初のスクリプト実行で、各段階に到達するまでの時間（2回目以降の記録は無視）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.phases = {}  # 段階 -> 秒（スクリプト開始から）
+
+    def mark(self, phase, seconds) -> bool:
+        """初めての段階なら記録して True を返す"""
+        with self._lock:
+            if phase in self.phases:
+                return False
+            self.phases[phase] = seconds
+            return True
+
+    def as_rows(self) -> list:
+        with self._lock:
+            return [{"段階": phase, "ミリ秒": round(seconds * 1000, 1)} for phase, seconds in self.phases.items()]
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""全会話のキーワード分析（assistant の回答を改行で分割したキーワードを、ペルソナ別・時系列・共起で集計）"""
+import time
+
+import streamlit as st
+
+from keyword_stats import KeywordStats
+from resources import local_store, sheet_sync
+
+_PAGE_STARTED = time.perf_counter()
+BACKFILL_WAIT = 10  # Google Sheets からの取り込み（バックフィル）の完了を待つ最大秒数
+
+st.set_page_config(page_title="キーワード分析 | ミノンBC AIファンチャット", layout="wide")
+
+
+@st.cache_resource
+def _keyword_stats() -> KeywordStats:
+    """チャットと同じローカルログ（SQLite）上の集計。全セッションで共有し、追記分だけ反映する"""
+    return KeywordStats(local_store().path)  # local_store() が chat_logs テーブルを作る
+
+
+def _wait_for_backfill():
+    """チャット画面と同じ同期（シート→ローカルのバックフィル）を始め、少し待つ。
+
+    (表示の種類 or None, 文面, 集計欄に添える短い状況) を返す。
+    """
+    try:
+        sync = sheet_sync()
+    except Exception as e:
+        return "warning", f"Google Sheetsに接続できないため、この環境のローカルログだけを集計しています: {e}", "Sheets 接続エラー"
+    if sync is None:
+        return "caption", "Google Sheets が未設定のため、この環境のローカルログだけを集計しています。", "Sheets 未設定"
+    if not sync.backfill_done.is_set():
+        with st.spinner("Google Sheets から過去のログを取り込んでいます..."):
+            sync.backfill_done.wait(BACKFILL_WAIT)
+    if not sync.backfill_done.is_set():
+        return "info", (f"Google Sheets から過去のログを取り込み中です（{sync.backfilled} 行取り込み済み）。"
+                        "集計は取り込み済みの分だけです。しばらくしてから再読み込みしてください。"), \
+            f"Sheets 取り込み中（{sync.backfilled} 行）"
+    if sync.backfill_error is not None:
+        return "warning", (f"Google Sheets からの取り込みに失敗したため、一部の行が集計に含まれていない可能性があります: "
+                           f"{sync.backfill_error}"), "Sheets 取り込みエラー"
+    return None, "", "Sheets 取り込み済み"
+
+
+st.title("キーワード分析")
+st.caption(
+    "全会話の assistant の回答を改行で分割したキーワード（CSV の「キーワード分割」と同じ区切り）を集計します。"
+    "数値はそのキーワードを含む回答の数です。"
+)
+
+backfill_kind, backfill_message, backfill_status = _wait_for_backfill()
+if backfill_kind is not None:
+    getattr(st, backfill_kind)(backfill_message)
+
+stats = _keyword_stats()
+update_started = time.perf_counter()
+with st.spinner("新しいログを集計に反映しています...（初回は全件を集計するため時間がかかります）"):
+    added = stats.update()
+update_ms = (time.perf_counter() - update_started) * 1000
+
+personas = stats.personas()
+if not personas:
+    st.info("まだ集計できる回答がありません。チャットで会話するとここに集計されます。")
+    st.stop()
+
+import pandas as pd  # noqa: E402  集計がある場合だけ読み込む
+
+selected = st.multiselect("ペルソナ（未選択なら全員）", list(personas))
+scope = selected or list(personas)
+answers_in_scope = sum(personas[p] for p in scope)
+limit = st.slider("表示するキーワード数", min_value=5, max_value=100, value=30)
+
+top = stats.top_keywords(selected, limit)
+keywords = [k for k, _ in top]
+
+# --- 頻出キーワード ---
+st.subheader("頻出キーワード")
+if not top:
+    st.info("選択したペルソナの回答にキーワードがありません。")
+    st.stop()
+df_top = pd.DataFrame(top, columns=["キーワード", "回答数"])
+df_top["割合"] = df_top["回答数"] / answers_in_scope * 100
+st.dataframe(
+    df_top,
+    hide_index=True,
+    column_config={
+        "回答数": st.column_config.ProgressColumn(format="%d", min_value=0, max_value=int(df_top["回答数"].max())),
+        "割合": st.column_config.NumberColumn(format="%.1f%%"),
+    },
+)
+
+# --- ペルソナ別 ---
+st.subheader("ペルソナ別")
+normalize = st.radio("表示", ["回答数", "ペルソナの回答に占める割合"], horizontal=True)
+df_persona = pd.DataFrame(stats.by_persona(keywords, selected), columns=["ペルソナ", "キーワード", "回答数"])
+matrix = (df_persona.pivot_table(index="キーワード", columns="ペルソナ", values="回答数", aggfunc="sum", fill_value=0)
+          .reindex(index=keywords, columns=[p for p in scope if p in set(df_persona["ペルソナ"])], fill_value=0))
+if normalize != "回答数":
+    matrix = (matrix / pd.Series(personas)[matrix.columns]).round(3)
+st.dataframe(matrix)
+
+# --- 推移 ---
+st.subheader("推移")
+col_kw, col_freq = st.columns([3, 1])
+trend_keywords = col_kw.multiselect("キーワード", keywords, default=keywords[:5])
+freq = col_freq.radio("集計単位", ["日", "週", "月"], horizontal=True)
+if trend_keywords:
+    df_trend = pd.DataFrame(stats.trend(trend_keywords, selected), columns=["日", "キーワード", "回答数"])
+    if df_trend.empty:
+        st.caption("日付の分かる回答がありません。")
+    else:
+        df_trend["日"] = pd.to_datetime(df_trend["日"])
+        series = (df_trend.pivot_table(index="日", columns="キーワード", values="回答数", aggfunc="sum", fill_value=0)
+                  .resample({"日": "D", "週": "W-MON", "月": "MS"}[freq]).sum())
+        st.line_chart(series)
+
+# --- 共起 ---
+st.subheader("一緒に出てくるキーワード")
+focus = st.selectbox("キーワード", keywords)
+co = pd.DataFrame(stats.cooccurring(focus, selected), columns=["キーワード", "回答数"])
+if co.empty:
+    st.caption("同じ回答に出てくるキーワードはありません。")
+else:
+    focus_count = dict(top).get(focus) or 1
+    co["条件付き割合"] = (co["回答数"] / focus_count).round(3)
+    st.dataframe(co, hide_index=True)
+    st.caption(f"条件付き割合: 「{focus}」を含む {focus_count} 回答のうち、そのキーワードも含む回答の割合")
+
+st.markdown("---")
+st.caption(
+    f"集計済み {sum(personas.values())} 回答（今回反映 {added} 件、{update_ms:.0f} ms）・"
+    f"表示まで {(time.perf_counter() - _PAGE_STARTED) * 1000:.0f} ms・{backfill_status}"
+)
+with st.expander("集計の管理"):
+    st.caption("集計対象はこのアプリのローカルログです（Google Sheets から取り込んだ行を含む。"
+               "取り込みはチャット画面かこのページを最初に開いたときに始まります）。")
+    if st.button("集計を作り直す"):
+        with st.spinner("全件を集計し直しています..."):
+            stats.rebuild()
+        st.rerun()
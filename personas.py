@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""ペルソナの表示名・アバター画像・Dify APIキーの対応"""
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Tuple
+
+# ペルソナの表示名とSecretsのキーをマッピング
+PERSONA_NAMES = [
+    "①ミノンBC理想ファン_乳児ママ_本田ゆい（30）",
+    "②ミノンBC理想ファン_乳児パパ_安西涼太（31）",
+    "③ミノンBC理想ファン_保育園/幼稚園ママ_戸田綾香（35）",
+    "④ミノンBC理想ファン_更年期女性_高橋恵子（48）",
+    "⑤ミノンBC未満ファン_乳児ママ_中村優奈（31）",
+    "⑥ミノンBC未満ファン_乳児パパ_岡田健志（32）",
+    "⑦ミノンBC未満ファン_保育園・幼稚園ママ_石田真帆（34）",
+    "⑧ミノンBC未満ファン_更年期女性_杉山紀子（51）",
+]
+
+# アバター（ファイルが無い場合は絵文字にフォールバック）
+PERSONA_AVATARS = {
+    "①ミノンBC理想ファン_乳児ママ_本田ゆい（30）": "persona_1.jpg",
+    "②ミノンBC理想ファン_乳児パパ_安西涼太（31）": "persona_2.jpg",
+    "③ミノンBC理想ファン_保育園/幼稚園ママ_戸田綾香（35）": "persona_3.jpg",
+    "④ミノンBC理想ファン_更年期女性_高橋恵子（48）": "persona_4.jpg",
+    "⑤ミノンBC未満ファン_乳児ママ_中村優奈（31）": "persona_5.jpg",
+    "⑥ミノンBC未満ファン_乳児パパ_岡田健志（32）": "persona_6.jpg",
+    "⑦ミノンBC未満ファン_保育園・幼稚園ママ_石田真帆（34）": "persona_7.png",
+    "⑧ミノンBC未満ファン_更年期女性_杉山紀子（51）": "persona_8.jpg",
+}
+
+
+def get_persona_api_keys(secrets):
+    """SecretsからAPIキーを読み込む（トップレベル/ネスト両対応 & フォールバック）
+
+    secrets は st.secrets または secrets.toml を読み込んだ dict
+    """
+    keys = {}
+
+    # 1) まずはトップレベル（従来）
+    for i, name in enumerate(PERSONA_NAMES):
+        k = secrets.get(f"PERSONA_{i+1}_KEY")
+        if k:
+            keys[name] = k
+
+    # 2) 次に [persona_api_keys] テーブル
+    if "persona_api_keys" in secrets:
+        table = secrets["persona_api_keys"]
+        for i, name in enumerate(PERSONA_NAMES):
+            k = table.get(f"PERSONA_{i+1}_KEY")
+            if k and name not in keys:
+                keys[name] = k
+
+    # 3) 何も見つからない場合の汎用フォールバック（任意）
+    if not keys:
+        generic = secrets.get("DIFY_API_KEY")
+        if generic:
+            for name in PERSONA_NAMES:
+                keys[name] = generic
+
+    return keys
+
+
+class PersonaConfig(NamedTuple):
+    """Secrets から一度だけ組み立てる変更不可のペルソナ設定"""
+    api_keys: Mapping[str, str]  # 表示名 -> APIキー（読み取り専用）
+    names: Tuple[str, ...]       # APIキーのあるペルソナ（表示順）
+
+
+def load_persona_config(secrets) -> PersonaConfig:
+    """get_persona_api_keys の結果を読み取り専用の PersonaConfig にする"""
+    keys = get_persona_api_keys(secrets)
+    return PersonaConfig(MappingProxyType(dict(keys)), tuple(keys))
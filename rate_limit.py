@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""API 呼び出しのレート制限（トークンバケット）と同時実行数の制御"""
+import collections
+import threading
+import time
+from contextlib import contextmanager
+
+
+class TokenBucket:
+    """rate 回/秒で補充され、最大 burst 個まで貯まるトークンバケット"""
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """トークンを1つ取る。取れたら 0、取れなければ次に取れるまでの秒数を返す"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=None) -> bool:
+        """トークンが取れるまで待つ。timeout 秒以内に取れなければ False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+
+class Governor:
+    """トークンバケット + 同時実行数の上限 + 先着順の待ち行列。
+
+    プロセス全体（全セッション）で共有し、API キーや Sheets クライアントごとに1つ持つ。
+    slot() に入った順に処理され、待っている間は on_wait(順番) で待ち順を通知する。
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0, max_concurrent: int = 4, poll_interval: float = 0.5):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrent = max_concurrent
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._waiting = collections.deque()
+        self._active = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @contextmanager
+    def slot(self, on_wait=None):
+        """順番が来てトークンと空き枠が取れたら入る with ブロック"""
+        ticket = object()
+        last_pos = None
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    wait = self.poll_interval
+                    if self._waiting[0] is ticket and self._active < self.max_concurrent:
+                        wait = self.bucket.try_acquire()
+                        if wait == 0:
+                            break
+                    pos = self._waiting.index(ticket) + 1
+                    if on_wait is not None and pos != last_pos:
+                        last_pos = pos
+                        self._cond.release()  # UI 更新などはロックの外で
+                        try:
+                            on_wait(pos)
+                        finally:
+                            self._cond.acquire()
+                    self._cond.wait(min(wait, self.poll_interval))
+                self._waiting.popleft()
+                self._active += 1
+                self._cond.notify_all()
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    self._cond.notify_all()
+                raise
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def call(self, fn, *args, **kwargs):
+        """slot() の中で fn を呼ぶ"""
+        with self.slot():
+            return fn(*args, **kwargs)
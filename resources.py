@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""プロセス全体で共有するチャットログの保存先（ローカル SQLite / Google Sheets）と処理時間の集計
+
+st.cache_resource の関数をこのモジュールに置くことで、チャット画面と pages/ 以下のページが
+同じオブジェクト（同じ SheetSynchronizer のバックフィルなど）を使う。
+"""
+import streamlit as st
+
+from history_index import SheetHistoryIndex
+from local_store import ChatLogStore
+from metrics import LatencyStats
+from rate_limit import Governor
+from sheet_sync import SheetSynchronizer
+from sheets import RetryingOpener, authorize, log_worksheet, service_account_info
+
+
+@st.cache_resource
+def latency_stats() -> LatencyStats:
+    """全セッション共通の処理時間の集計（段階・ペルソナごと）"""
+    return LatencyStats()
+
+
+@st.cache_resource
+def sheets_governor() -> Governor:
+    """Google Sheets API 呼び出しの流量制御（書き込み・履歴読み込み・バックフィルで共有）"""
+    return Governor(
+        rate=float(st.secrets.get("SHEETS_RATE_PER_MIN", 50)) / 60,
+        burst=float(st.secrets.get("SHEETS_BURST", 5)),
+        max_concurrent=int(st.secrets.get("SHEETS_MAX_CONCURRENCY", 2)),
+    )
+
+
+# =========================
+# Google Sheets 接続ユーティリティ
+# =========================
+def _get_sa_dict():
+    """Secretsの gcp_service_account から dict を返す（JSON文字列/TOMLテーブル両対応）"""
+    return service_account_info(st.secrets)
+
+
+@st.cache_resource
+def _gs_client():
+    """gspread クライアントを返す（キャッシュする）"""
+    sa_info = _get_sa_dict()
+    if not sa_info:
+        raise RuntimeError("`gcp_service_account` がSecretsに設定されていません。")
+    return authorize(sa_info)
+
+
+def _open_sheet():
+    """chat_logs ワークシートを開く（なければ作成）。権限/IDエラーは原因が分かる例外にする。
+    ログはローカルに保存されるので、シートを開けなくてもチャット画面は止めない。"""
+    from gspread.exceptions import SpreadsheetNotFound, GSpreadException
+
+    if "gsheet_id" not in st.secrets:
+        raise RuntimeError("`gsheet_id` がSecretsに設定されていません。")
+
+    gc = _gs_client()
+    sheet_id = st.secrets["gsheet_id"]
+
+    try:
+        sh = gc.open_by_key(sheet_id)
+    except SpreadsheetNotFound:
+        raise RuntimeError("スプレッドシートが見つかりません。Secrets の `gsheet_id` を確認してください。") from None
+    except GSpreadException as e:
+        if "PERMISSION_DENIED" in str(e):
+            email = _get_sa_dict().get("client_email", "(unknown)")
+            raise RuntimeError(
+                f"スプレッドシートへのアクセス権がありません。対象シートをサービスアカウント {email} に『編集者』で共有してください。"
+            ) from e
+        raise
+
+    return log_worksheet(sh)
+
+
+@st.cache_resource
+def _sheet_opener() -> RetryingOpener:
+    """chat_logs を開く処理を全セッションで共有する。失敗したら SHEETS_RETRY_BACKOFF 秒（失敗のたびに倍）は開き直さない"""
+    def open_sheet():
+        with latency_stats().timer("open_sheet"):
+            return _open_sheet()
+
+    return RetryingOpener(open_sheet, backoff=float(st.secrets.get("SHEETS_RETRY_BACKOFF", 10)))
+
+
+# =========================
+# ログ保存（ローカル SQLite が正、Google Sheets へ非同期ミラー）
+# =========================
+@st.cache_resource
+def local_store() -> ChatLogStore:
+    """プロセス全体で共有するローカルログ（SQLite / WAL）"""
+    return ChatLogStore(st.secrets.get("LOCAL_DB_PATH", "chat_logs.sqlite3"))
+
+
+def sheets_configured() -> bool:
+    return "gsheet_id" in st.secrets and "gcp_service_account" in st.secrets
+
+
+@st.cache_resource
+def sheet_sync():
+    """ローカルログ→シートのミラーと、起動時のシート→ローカルのバックフィルを行う（Sheets 未設定なら None）"""
+    if not sheets_configured():
+        return None
+    return SheetSynchronizer(local_store(), _sheet_opener().get(), limiter=sheets_governor(), metrics=latency_stats())
+
+
+@st.cache_resource
+def history_index() -> SheetHistoryIndex:
+    """プロセス全体で共有する 会話ID→行番号 インデックス（以後は追記分だけ読む）"""
+    return SheetHistoryIndex(_sheet_opener().get(), limiter=sheets_governor(), metrics=latency_stats())
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""ローカル SQLite ログと Google Sheets (chat_logs) の非同期同期"""
+import threading
+
+from history_index import col_letter
+from local_store import LOG_COLUMNS
+from log_writer import SheetLogWriter
+
+
+class SheetSynchronizer:
+    """SQLite を正としてシートと同期する。
+
+    - mirror(): 新しい行を write-behind キューに積み、書けたら synced=1 にする
+    - 起動時: 前回プロセスで未同期のまま残った行を再送し、シートの行を
+      ローカルに取り込む（バックフィル）。取り込み位置は meta に保存して次回は差分のみ
+    backfill_done はバックフィルが終わると set される（backfill=False なら取り込まないので set されない）。
+    """
+
+    META_LAST_ROW = "sheet_last_row"
+
+    def __init__(self, store, worksheet, backfill_chunk=5000, backfill=True, limiter=None, metrics=None):
+        self.store = store
+        self._ws = worksheet
+        self._limiter = limiter
+        self.backfill_chunk = backfill_chunk
+        self._backfill_on_start = backfill
+        self.writer = SheetLogWriter(worksheet, on_written=store.mark_synced, limiter=limiter, metrics=metrics)
+
+        self.backfill_done = threading.Event()
+        self.backfill_error = None
+        self.backfilled = 0
+        self._thread = threading.Thread(target=self._startup, name="sheet-sync-startup", daemon=True)
+        self._thread.start()
+
+    def _call(self, fn, *args):
+        return self._limiter.call(fn, *args) if self._limiter else fn(*args)
+
+    def mirror(self, row_id, row):
+        """ローカルに保存した行をシートへ反映する（非同期）"""
+        self.writer.enqueue(row, key=row_id)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.writer.queue_depth
+
+    @property
+    def last_error(self):
+        return self.writer.last_error or self.backfill_error
+
+    def _startup(self):
+        for row_id, row in self.store.unsynced():
+            self.writer.enqueue(row, key=row_id)
+        if not self._backfill_on_start:
+            return
+        try:
+            self.backfill()
+        except Exception as e:
+            self.backfill_error = e
+        finally:
+            self.backfill_done.set()
+
+    def backfill(self):
+        """前回取り込んだ行より後ろのシート行をローカルに取り込む"""
+        header = self._call(self._ws.row_values, 1) or LOG_COLUMNS
+        last_col = col_letter(len(header))
+        start = int(self.store.get_meta(self.META_LAST_ROW, 1)) + 1
+        while True:
+            end = start + self.backfill_chunk - 1
+            values = self._call(self._ws.get, f"A{start}:{last_col}{end}")
+            rows = [dict(zip(header, list(v) + [""] * (len(header) - len(v)))) for v in values if v]
+            self.backfilled += self.store.import_rows(rows)
+            if values:
+                self.store.set_meta(self.META_LAST_ROW, start + len(values) - 1)
+            if len(values) < self.backfill_chunk:
+                return
+            start = end + 1
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Google Sheets (chat_logs ワークシート) への接続"""
+import json
+import threading
+import time
+
+from local_store import LOG_COLUMNS
+
+WORKSHEET_TITLE = "chat_logs"
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+def service_account_info(secrets):
+    """Secretsの gcp_service_account から dict を返す（JSON文字列/TOMLテーブル両対応）"""
+    if "gcp_service_account" not in secrets:
+        return None
+    raw = secrets["gcp_service_account"]
+    if isinstance(raw, str):
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            # private_key の実改行を \n に自動補正して再トライ（貼付ミス救済）
+            fixed = raw.replace("\r\n", "\n").replace("\n", "\\n")
+            return json.loads(fixed)
+    return dict(raw)
+
+
+def authorize(sa_info):
+    """サービスアカウント情報から gspread クライアントを作る"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_info(sa_info, scopes=SCOPES)
+    return gspread.authorize(creds)
+
+
+def log_worksheet(sh):
+    """chat_logs ワークシートを返す（なければヘッダー付きで作成）"""
+    from gspread.exceptions import WorksheetNotFound
+
+    try:
+        return sh.worksheet(WORKSHEET_TITLE)
+    except WorksheetNotFound:
+        ws = sh.add_worksheet(title=WORKSHEET_TITLE, rows=1000, cols=10)
+        ws.append_row(LOG_COLUMNS)
+        return ws
+
+
+def open_log_worksheet(secrets):
+    """Streamlit の外（CLI など）から chat_logs を開く。設定不足は ValueError"""
+    sa_info = service_account_info(secrets)
+    if not sa_info:
+        raise ValueError("`gcp_service_account` がSecretsに設定されていません。")
+    if "gsheet_id" not in secrets:
+        raise ValueError("`gsheet_id` がSecretsに設定されていません。")
+    return log_worksheet(authorize(sa_info).open_by_key(secrets["gsheet_id"]))
+
+
+class RetryingOpener:
+    """失敗しうる接続（シートを開くなど）を一度だけ開いて共有する。
+
+    失敗はしばらく覚えておき、その間は開き直さずに同じ例外を送出する（Sheets が使えない間、
+    再実行やログ保存のたびに API を呼んで待たされないように）。待ち時間は失敗のたびに倍にし、
+    max_backoff 秒まで。
+    """
+
+    def __init__(self, opener, backoff=10.0, max_backoff=300.0):
+        self._opener = opener
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._value = None
+        self._retry_at = 0.0
+        self.failures = 0
+        self.last_error = None
+
+    def get(self):
+        with self._lock:
+            if self._value is not None:
+                return self._value
+            if self.last_error is not None and time.monotonic() < self._retry_at:
+                raise self.last_error.with_traceback(None)
+            try:
+                self._value = self._opener()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                self._retry_at = time.monotonic() + min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+                raise
+            self.last_error = None
+            return self._value
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""リポジトリのルートにあるモジュール（utils, rate_limit など）と bench を import できるようにする"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
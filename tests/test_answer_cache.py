@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""AnswerCache"""
+import threading
+import time
+
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_make_key_normalizes_query_and_inputs():
+    key = AnswerCache.make_key("app-key", "質問", {"a": "1", "b": {"x": [1, 2]}})
+    assert AnswerCache.make_key("app-key", "  質問\n", {"b": {"x": [1, 2]}, "a": "1"}) == key
+    assert AnswerCache.make_key("other-key", "質問", {"a": "1", "b": {"x": [1, 2]}}) != key
+    assert AnswerCache.make_key("app-key", "質問", {"a": "2", "b": {"x": [1, 2]}}) != key
+    assert AnswerCache.make_key("app-key", "質問") == AnswerCache.make_key("app-key", "質問", {})
+
+
+def test_make_key_distinguishes_long_inputs():
+    csv_a = "col\n" + "a\n" * 500
+    csv_b = "col\n" + "a\n" * 499 + "b\n"
+    assert AnswerCache.make_key("k", "q", {"csv": csv_a}) != AnswerCache.make_key("k", "q", {"csv": csv_b})
+
+
+def test_get_put_and_stats():
+    cache = AnswerCache()
+    assert cache.get("k") is None
+    cache.put("k", "answer")
+    assert cache.get("k") == "answer"
+    assert cache.get("other", count_miss=False) is None
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "evictions": 0, "hit_rate": 0.5}
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = AnswerCache(ttl=60)
+    cache.put("k", "answer")
+    clock[0] += 60
+    assert cache.get("k") == "answer"
+    clock[0] += 0.001
+    assert cache.get("k") is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["evictions"] == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    cache.get("a")  # a を最近使ったことにする
+    cache.put("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_single_flight_makes_followers_wait_for_the_answer():
+    cache = AnswerCache()
+    calls = []
+    first_inside = threading.Event()
+
+    def ask(i):
+        if cache.get("k") is not None:
+            return
+        with cache.single_flight("k"):
+            if cache.get("k", count_miss=False) is not None:
+                return
+            calls.append(i)
+            first_inside.set()
+            time.sleep(0.05)
+            cache.put("k", f"answer {i}")
+
+    first = threading.Thread(target=ask, args=(0,))
+    first.start()
+    first_inside.wait(5)
+    others = [threading.Thread(target=ask, args=(i,)) for i in range(1, 5)]
+    for t in others:
+        t.start()
+    for t in [first] + others:
+        t.join()
+
+    assert calls == [0]
+    assert cache.get("k") == "answer 0"
+
+
+def test_single_flight_releases_on_error():
+    cache = AnswerCache()
+    with pytest.raises(RuntimeError):
+        with cache.single_flight("k"):
+            raise RuntimeError("dify down")
+    with cache.single_flight("k"):  # 待たされずに入れる
+        pass
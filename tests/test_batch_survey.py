@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""batch_survey の --dedupe（bench/dify_stub.py のスタブ相手）"""
+import csv
+
+from batch_survey import main
+from bench.dify_stub import DifyStub, StubConfig
+from chat_turn import PENDING_CID
+from local_store import ChatLogStore
+
+
+def test_dedupe_asks_once_and_logs_only_real_conversations(tmp_path):
+    config = StubConfig(latency=0.05, seed=0)
+    questions = tmp_path / "q.csv"
+    questions.write_text("id,question\n1,Q1\n2,Q2\n3,Q1\n4,Q1\n", encoding="utf-8")
+    db = tmp_path / "chat_logs.sqlite3"
+    output = tmp_path / "out.csv"
+    with DifyStub(config) as stub:
+        secrets = tmp_path / "secrets.toml"
+        secrets.write_text(f'PERSONA_1_KEY = "app-x"\nDIFY_CHAT_URL = "{stub.url}"\n'
+                           f'LOCAL_DB_PATH = "{db.as_posix()}"\n', encoding="utf-8")
+        status = main([str(questions), "-o", str(output), "--secrets", str(secrets),
+                       "--dedupe", "--log", "--rate", "100", "--workers", "4"])
+
+    assert status == 0
+    assert config.requests == 2
+
+    with open(output, encoding="utf-8-sig", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [r["question_id"] for r in rows] == ["1", "2", "3", "4"]
+    assert len({r["content"] for r in rows if r["question"] == "Q1"}) == 1
+    assert sum(1 for r in rows if r["conversation_id"]) == 2  # 使い回した回答には会話が無い
+
+    store = ChatLogStore(str(db))
+    logged = store._conn().execute("SELECT conversation_id, role, content FROM chat_logs").fetchall()
+    assert len(logged) == 4  # 実際に問い合わせた2件の質問と回答だけ
+    assert all(cid and cid != PENDING_CID for cid, _, _ in logged)
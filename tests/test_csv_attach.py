@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""csv_attach: アップロードCSVのチャンク読み込み・要約と、トークン予算内での添付テキスト"""
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+from csv_attach import MAX_TRACKED_VALUES, PREVIEW_ROWS, encode_for_budget, estimate_tokens, summarize_csv
+
+
+def _csv(frame) -> bytes:
+    return frame.to_csv(index=False).encode("utf-8")
+
+
+@pytest.fixture
+def data():
+    n = 103
+    return _csv(pd.DataFrame({
+        "id": range(n),
+        "score": [None if i % 10 == 0 else i / 2 for i in range(n)],
+        "group": [f"g{i % 3}" for i in range(n)],
+        "memo": [f"メモ{i}" for i in range(n)],
+    }))
+
+
+def test_chunked_summary_matches_a_single_read(data):
+    whole = summarize_csv(data, chunksize=10_000, sample_rows=20)
+    chunked = summarize_csv(data, chunksize=7, sample_rows=20)
+
+    assert chunked["rows"] == whole["rows"] == 103
+    assert chunked["dtypes"] == whole["dtypes"]
+    assert chunked["values"] == whole["values"]
+    pd.testing.assert_frame_equal(chunked["stats"], whole["stats"])
+    pd.testing.assert_frame_equal(chunked["preview"], whole["preview"])
+    pd.testing.assert_frame_equal(chunked["sample"], whole["sample"])
+
+
+def test_summary_contents(data):
+    summary = summarize_csv(data, chunksize=7, sample_rows=20)
+    stats = summary["stats"].set_index("column")
+
+    assert summary["columns"] == ["id", "score", "group", "memo"]
+    assert len(summary["preview"]) == PREVIEW_ROWS
+    assert list(summary["preview"]["id"]) == list(range(PREVIEW_ROWS))
+    assert summary["dtypes"]["score"] == "float64"
+    assert stats.loc["score", "non_null"] == 103 - 11
+    assert stats.loc["id", "min"] == 0 and stats.loc["id", "max"] == 102
+    assert stats.loc["id", "mean"] == pytest.approx(51)
+    assert pd.isna(stats.loc["group", "mean"])
+    assert summary["values"]["group"] == {"g0": 35, "g1": 34, "g2": 34}
+    assert set(summary["values"]) == {"group", "memo"}
+
+
+def test_sample_is_bounded_and_in_original_order(data):
+    sample = summarize_csv(data, chunksize=7, sample_rows=20)["sample"]
+    assert len(sample) == 20
+    assert list(sample.index) == sorted(sample.index)
+    assert list(sample.columns) == ["id", "score", "group", "memo"]
+    assert summarize_csv(data, sample_rows=500)["sample"]["id"].tolist() == list(range(103))
+
+
+def test_int_column_with_missing_values_in_a_later_chunk_becomes_float():
+    data = b"n,k\n1,a\n2,b\n3,c\n,d\n5,e\n"
+    summary = summarize_csv(data, chunksize=3)
+    stats = summary["stats"].set_index("column")
+    assert summary["dtypes"]["n"] == "float64"
+    assert stats.loc["n", "non_null"] == 4
+    assert stats.loc["n", "max"] == 5
+
+
+def test_column_turning_non_numeric_drops_numeric_stats():
+    data = b"v\n1\n2\n3\nx\n"
+    summary = summarize_csv(data, chunksize=3)
+    stats = summary["stats"].set_index("column")
+    assert summary["dtypes"]["v"] == str(pd.Series(["x"]).dtype)
+    assert summary["values"] == {"v": None}  # 途中から数え始めた頻出値は出さない
+    assert pd.isna(stats.loc["v", "min"])
+
+
+def test_too_many_distinct_values_are_not_tracked():
+    data = _csv(pd.DataFrame({"k": [f"v{i}" for i in range(MAX_TRACKED_VALUES + 1)]}))
+    assert summarize_csv(data, chunksize=50)["values"] == {"k": None}
+
+
+def test_usecols_and_nrows(data):
+    summary = summarize_csv(data, usecols=["id", "group"], nrows=30, chunksize=7)
+    assert summary["columns"] == ["id", "group"]
+    assert summary["rows"] == 30
+
+
+def test_header_only_csv():
+    summary = summarize_csv(b"a,b\n")
+    assert summary["rows"] == 0
+    assert summary["columns"] == ["a", "b"]
+    assert summary["sample"].empty and list(summary["sample"].columns) == ["a", "b"]
+
+
+# ---- 添付テキスト ----
+@pytest.fixture
+def wide_summary():
+    n = 400
+    return summarize_csv(_csv(pd.DataFrame({
+        "id": range(n),
+        "country": ["JP"] * n,  # 値が1種類の列
+        "comment": [f"とても長いコメント{i} " * 20 for i in range(n)],
+        "rating": [i % 5 for i in range(n)],
+    })))
+
+
+def _sample_rows(text):
+    _, _, body = text.partition("\n## ランダムサンプル")
+    return list(csv.reader(io.StringIO(body.split("\n", 1)[1]))) if body else []
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("日本語") == 3
+
+
+@pytest.mark.parametrize("budget", [400, 1000, 3000, 8000])
+def test_text_fits_the_budget(wide_summary, budget):
+    text, info = encode_for_budget(wide_summary, budget)
+    assert info["tokens"] == estimate_tokens(text) <= budget
+    assert info["budget"] == budget
+    assert text.startswith("# CSV 全400行 × 4列\n## 列の要約\n")
+    rows = _sample_rows(text)
+    assert len(rows) == (info["sample_rows"] + 1 if info["sample_rows"] else 0)  # ヘッダー行 + サンプル行
+
+
+def test_larger_budget_includes_more_rows(wide_summary):
+    rows = [encode_for_budget(wide_summary, b)[1]["sample_rows"] for b in (1000, 3000, 8000)]
+    assert rows == sorted(rows) and rows[-1] > rows[0] > 0
+
+
+def test_constant_columns_are_summarized_but_not_repeated_in_rows(wide_summary):
+    text, _ = encode_for_budget(wide_summary, 3000)
+    assert "- country [" in text and "頻出: JP(400)" in text
+    assert _sample_rows(text)[0] == ["id", "comment", "rating"]
+
+
+def test_cells_are_clipped_to_fit_more_rows(wide_summary):
+    text, info = encode_for_budget(wide_summary, 1000)
+    assert info["cell_limit"] < 200
+    comments = [r[1] for r in _sample_rows(text)[1:]]
+    assert comments and all(len(c) <= info["cell_limit"] and c.endswith("…") for c in comments)
+
+
+def test_budget_smaller_than_the_column_summary():
+    summary = summarize_csv(_csv(pd.DataFrame({f"col{i}": [i] for i in range(50)})))
+    text, info = encode_for_budget(summary, 120)
+    assert info["sample_rows"] == 0 and info["cell_limit"] == 0
+    assert info["tokens"] <= 120
+    assert text.startswith("# CSV 全1行 × 50列\n## 列の要約\n- col0 ")
+    assert "ランダムサンプル" not in text
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""dify_client: SSE の読み取りと再試行の判定"""
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from dify_client import DifyClient, DifyStreamError, _connection_not_established, stream_dify_answer
+
+
+class FakeStreamResponse:
+    """requests.Response のうち stream_dify_answer が使う部分だけ"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.encoding = None
+        self.consumed = 0
+
+    def iter_lines(self, decode_unicode=False):
+        for line in self.lines:
+            self.consumed += 1
+            yield line
+
+
+def _data(**event):
+    return "data: " + json.dumps(event, ensure_ascii=False)
+
+
+def test_stream_concatenates_answer_and_reports_progress():
+    res = FakeStreamResponse([
+        "event: ping",
+        "",
+        _data(event="message", conversation_id="c1", answer="こん"),
+        _data(event="agent_message", conversation_id="c1", answer="にちは"),
+        _data(event="message_end", conversation_id="c1"),
+    ])
+    tokens, cids = [], []
+    answer, cid = stream_dify_answer(res, on_token=tokens.append, on_conversation_id=cids.append)
+
+    assert (answer, cid) == ("こんにちは", "c1")
+    assert tokens == ["こん", "こんにちは"]
+    assert cids == ["c1"]
+    assert res.encoding == "utf-8"  # charset 無指定でも日本語を化けさせない
+
+
+def test_stream_skips_blank_and_broken_data_lines():
+    res = FakeStreamResponse([
+        "data:",
+        "data: {not json",
+        ": comment",
+        _data(event="message", answer="a"),
+        _data(event="message_end", conversation_id="c1"),
+    ])
+    assert stream_dify_answer(res) == ("a", "c1")
+
+
+def test_message_replace_overrides_answer():
+    res = FakeStreamResponse([
+        _data(event="message", answer="NG な回答"),
+        _data(event="message_replace", answer="差し替え"),
+        _data(event="message_end"),
+    ])
+    assert stream_dify_answer(res) == ("差し替え", None)
+
+
+def test_stream_is_read_to_the_end_after_message_end():
+    res = FakeStreamResponse([
+        _data(event="message", answer="a"),
+        _data(event="message_end"),
+        _data(event="message", answer="後から来た断片"),
+        _data(event="tts_message_end"),
+    ])
+    assert stream_dify_answer(res)[0] == "a"
+    assert res.consumed == 4  # 接続をプールへ戻すため最後まで読む
+
+
+def test_error_event_raises():
+    res = FakeStreamResponse([
+        _data(event="message", answer="a"),
+        _data(event="error", status=400, code="invalid_param", message="bad"),
+    ])
+    with pytest.raises(DifyStreamError, match="400 invalid_param: bad"):
+        stream_dify_answer(res)
+
+
+def test_stream_closed_before_message_end_raises():
+    res = FakeStreamResponse([
+        _data(event="message", conversation_id="c1", answer="途中まで"),
+    ])
+    cids = []
+    with pytest.raises(DifyStreamError, match="4 文字"):
+        stream_dify_answer(res, on_conversation_id=cids.append)
+    assert cids == ["c1"]  # 会話IDは分かった時点で通知済み
+
+
+# ---- 再試行 ----
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """server.script の先頭から1つずつ取り出して応答する（"abort" は本文を読んだ後に黙って切断、
+    "slow" は応答前に待つ。使い切ったら 200）"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.server.lock:
+            self.server.received += 1
+            action = self.server.script.pop(0) if self.server.script else 200
+        if action == "abort":
+            self.close_connection = True
+            return
+        if action == "slow":
+            time.sleep(0.5)
+            action = 200
+        body = json.dumps({"answer": "ok", "conversation_id": "c1"}).encode("utf-8")
+        self.send_response(action)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if action == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+    httpd.script, httpd.received, httpd.lock = [], 0, threading.Lock()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _client(url, **kwargs):
+    kwargs.setdefault("max_retries", 3)
+    return DifyClient("app-key", url, backoff_base=0, backoff_max=0.01, **kwargs)
+
+
+def _url(httpd):
+    return f"http://127.0.0.1:{httpd.server_address[1]}/v1/chat-messages"
+
+
+PAYLOAD = {"inputs": {}, "query": "q", "user": "u", "response_mode": "blocking", "conversation_id": "c1"}
+
+
+def test_rate_limited_and_unavailable_are_retried(server):
+    server.script = [429, 503]
+    res = _client(_url(server)).chat_messages(dict(PAYLOAD))
+    assert res.status_code == 200
+    assert server.received == 3
+
+
+def test_retries_stop_at_max_retries(server):
+    server.script = [503] * 5
+    res = _client(_url(server), max_retries=2).chat_messages(dict(PAYLOAD))
+    assert res.status_code == 503
+    assert server.received == 3
+
+
+@pytest.mark.parametrize("status", [500, 502, 504, 400])
+def test_gateway_and_other_errors_are_not_resent(server, status):
+    server.script = [status]
+    res = _client(_url(server)).chat_messages(dict(PAYLOAD))
+    assert res.status_code == status
+    assert server.received == 1
+
+
+def test_connection_dropped_after_send_is_not_resent(server):
+    server.script = ["abort"]
+    with pytest.raises(requests.exceptions.ConnectionError) as exc_info:
+        _client(_url(server)).chat_messages(dict(PAYLOAD))
+    assert not _connection_not_established(exc_info.value)
+    assert server.received == 1
+
+
+def test_read_timeout_is_not_resent(server):
+    server.script = ["slow"]
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        _client(_url(server), read_timeout=0.1).chat_messages(dict(PAYLOAD))
+    time.sleep(0.5)
+    assert server.received == 1
+
+
+def test_refused_connection_is_retried(monkeypatch):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]  # 閉じた後は誰も listen していないポート
+    client = _client(f"http://127.0.0.1:{port}/v1/chat-messages", max_retries=2)
+    attempts = []
+    post = client.session.post
+    monkeypatch.setattr(client.session, "post", lambda *a, **kw: attempts.append(1) or post(*a, **kw))
+
+    with pytest.raises(requests.exceptions.ConnectionError) as exc_info:
+        client.chat_messages(dict(PAYLOAD))
+    assert _connection_not_established(exc_info.value)
+    assert len(attempts) == 3
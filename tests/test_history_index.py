@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""SheetHistoryIndex（bench/fake_sheets.py の FakeWorksheet 相手）"""
+import pytest
+
+from bench.fake_sheets import FakeWorksheet
+from history_index import SheetHistoryIndex, col_letter
+from local_store import LOG_COLUMNS
+
+
+def _row(i, cid):
+    return [f"2026-01-01T00:00:{i:02d}", cid, "bot", "user" if i % 2 else "assistant", "name", f"msg{i}"]
+
+
+@pytest.fixture
+def ws():
+    ws = FakeWorksheet()
+    ws.preload([_row(i, "c1" if i % 3 else "c2") for i in range(9)])
+    return ws
+
+
+def test_col_letter():
+    assert [col_letter(n) for n in (1, 2, 26, 27, 52, 703)] == ["A", "B", "Z", "AA", "AZ", "AAA"]
+
+
+def test_rows_for_returns_the_conversation_in_sheet_order(ws):
+    index = SheetHistoryIndex(ws)
+    rows = index.rows_for("c2")
+    assert [r["content"] for r in rows] == ["msg0", "msg3", "msg6"]
+    assert rows[0] == dict(zip(LOG_COLUMNS, _row(0, "c2")))
+    assert index.row_numbers("c2") == [2, 5, 8]
+    assert index.rows_for("missing") == []
+
+
+def test_refresh_reads_only_appended_rows(ws):
+    index = SheetHistoryIndex(ws)
+    index.refresh()
+    assert index.last_row == 10
+    assert ws.calls == {"row_values": 1, "get": 1}
+
+    ws.append_rows([_row(9, "c2"), _row(10, "c3")])
+    index.refresh()  # min_refresh_interval 内なので読まない
+    assert ws.calls["get"] == 1
+    index.refresh(force=True)
+    assert ws.calls == {"row_values": 1, "get": 2, "append_rows": 1}
+    assert index.last_row == 12
+    assert index.row_numbers("c2") == [2, 5, 8, 11]
+    assert index.row_numbers("c3") == [12]
+
+
+def test_rows_are_fetched_once_in_contiguous_ranges(ws, monkeypatch):
+    index = SheetHistoryIndex(ws)
+    requested = []
+    batch_get = ws.batch_get
+    monkeypatch.setattr(ws, "batch_get", lambda ranges: requested.append(ranges) or batch_get(ranges))
+
+    index.rows_for("c1")
+    assert requested == [["A3:F4", "A6:F7", "A9:F10"]]
+    index.rows_for("c1")
+    assert len(requested) == 1  # 読んだ行は再利用する
+
+
+def test_short_rows_are_padded_to_header():
+    ws = FakeWorksheet()
+    ws.preload([["2026-01-01T00:00:00", "c1", "bot", "user"]])
+    assert SheetHistoryIndex(ws).rows_for("c1") == [
+        dict(zip(LOG_COLUMNS, ["2026-01-01T00:00:00", "c1", "bot", "user", "", ""]))
+    ]
+
+
+def test_header_without_conversation_id_is_rejected():
+    with pytest.raises(ValueError):
+        SheetHistoryIndex(FakeWorksheet(header=["timestamp", "content"])).refresh()
+
+
+def test_reset_rereads_from_the_top(ws):
+    index = SheetHistoryIndex(ws)
+    index.rows_for("c2")
+    index.reset()
+    assert index.row_numbers("c2") == []
+    assert [r["content"] for r in index.rows_for("c2")] == ["msg0", "msg3", "msg6"]
+    assert ws.calls["row_values"] == 2
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""KeywordStats.update の差分集計"""
+import pytest
+
+from keyword_stats import KeywordStats
+from local_store import ChatLogStore
+
+_seq = iter(range(1_000_000))
+
+
+def _append(store, role, content, bot="A", day="2026-03-01"):
+    i = next(_seq)
+    return store.append([f"{day}T00:00:{i % 60:02d}.{i:06d}+00:00", "cid", bot, role, bot, content])
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatLogStore(str(tmp_path / "chat_logs.sqlite3"))
+
+
+def test_update_counts_only_new_answers(store):
+    stats = KeywordStats(store.path)
+    _append(store, "user", "質問\n無視される")
+    _append(store, "assistant", "kw1\nkw2")
+    _append(store, "assistant", "kw1\n kw1 \n\nkw3", bot="B")  # 同じ回答内の重複は1回
+    assert stats.update() == 2
+    assert stats.personas() == {"A": 1, "B": 1}
+    assert stats.top_keywords() == [("kw1", 2), ("kw2", 1), ("kw3", 1)]
+
+    assert stats.update() == 0
+    assert stats.top_keywords() == [("kw1", 2), ("kw2", 1), ("kw3", 1)]
+
+    _append(store, "assistant", "kw2\nkw4", day="2026-03-02")
+    assert stats.update() == 1
+    assert stats.personas() == {"A": 2, "B": 1}
+    assert stats.top_keywords() == [("kw1", 2), ("kw2", 2), ("kw3", 1), ("kw4", 1)]
+    assert stats.top_keywords(["B"]) == [("kw1", 1), ("kw3", 1)]
+    assert sorted(stats.by_persona(["kw1"])) == [("A", "kw1", 1), ("B", "kw1", 1)]
+    assert stats.trend(["kw2"]) == [("2026-03-01", "kw2", 1), ("2026-03-02", "kw2", 1)]
+    assert stats.cooccurring("kw2") == [("kw1", 1), ("kw4", 1)]
+
+
+def test_watermark_skips_non_assistant_rows(store):
+    stats = KeywordStats(store.path)
+    _append(store, "assistant", "kw1")
+    stats.update()
+    last = _append(store, "user", "kw1")
+    assert stats.update() == 0
+    assert stats.watermark == last
+
+
+def test_update_in_chunks_matches_rebuild(store):
+    stats = KeywordStats(store.path, chunk_rows=3)
+    for i in range(8):
+        _append(store, "assistant", f"kw{i % 4}\nkw{(i + 1) % 4}", bot="AB"[i % 2])
+    assert stats.update() == 8
+    incremental = (stats.personas(), stats.top_keywords(), stats.trend(["kw0", "kw1"]))
+
+    assert stats.rebuild() == 8
+    assert (stats.personas(), stats.top_keywords(), stats.trend(["kw0", "kw1"])) == incremental
+    assert dict(stats.top_keywords()) == {"kw0": 4, "kw1": 4, "kw2": 4, "kw3": 4}
+
+
+def test_two_instances_do_not_double_count(store):
+    _append(store, "assistant", "kw1")
+    first, second = KeywordStats(store.path), KeywordStats(store.path)
+    assert first.update() == 1
+    assert second.update() == 0
+    assert second.top_keywords() == [("kw1", 1)]
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""LiveSyncHub（bench/fake_sheets.py の FakeWorksheet 相手）"""
+import time
+
+import pytest
+
+from bench.fake_sheets import FakeWorksheet
+from history_index import SheetHistoryIndex
+from live_sync import LiveSyncHub
+from local_store import ChatLogStore
+
+
+def _row(i, cid):
+    return [f"2026-01-01T00:00:{i:02d}", cid, "bot", "user", f"user{i}", f"msg{i}"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatLogStore(str(tmp_path / "chat_logs.sqlite3"))
+
+
+@pytest.fixture
+def ws():
+    ws = FakeWorksheet()
+    ws.preload([_row(0, "c1"), _row(1, "c2"), _row(2, "c1")])
+    return ws
+
+
+@pytest.fixture
+def make_hub():
+    hubs = []
+
+    def make(store, ws, **kwargs):
+        index = SheetHistoryIndex(ws, min_refresh_interval=0)
+        # ポーラーは interval 秒後まで動かないので、テストでは poll_once を直接呼ぶ
+        hub = LiveSyncHub(store, lambda: index, interval=60, **kwargs)
+        hubs.append(hub)
+        return hub
+
+    yield make
+    for hub in hubs:
+        hub.close()
+
+
+def test_poll_imports_new_rows_of_subscribed_conversations(store, ws, make_hub):
+    hub = make_hub(store, ws)
+    hub.subscribe("c1")
+    assert hub.poll_once() == 2
+    assert [r["content"] for r in store.history("c1")] == ["msg0", "msg2"]
+    assert store.history("c2") == []
+
+    ws.append_rows([_row(3, "c2"), _row(4, "c1")])
+    batch_gets = ws.calls["batch_get"]
+    assert hub.poll_once() == 1
+    assert ws.calls["batch_get"] == batch_gets + 1  # 新しい行だけを読む
+    assert [r["content"] for r in store.history("c1")] == ["msg0", "msg2", "msg4"]
+    assert hub.poll_once() == 0
+    assert (hub.polls, hub.imported) == (3, 3)
+
+
+def test_rows_already_stored_locally_are_not_counted(store, ws, make_hub):
+    store.append(_row(0, "c1"))
+    hub = make_hub(store, ws)
+    hub.subscribe("c1")
+    assert hub.poll_once() == 1
+    assert len(store.history("c1")) == 2
+
+
+def test_idle_subscriptions_stop_polling(store, ws, make_hub):
+    hub = make_hub(store, ws, idle_timeout=0.05)
+    hub.subscribe("c1")
+    time.sleep(0.1)
+    assert hub.active() == []
+    assert hub.poll_once() == 0
+    assert "get" not in ws.calls  # 購読が無ければシートを読まない
+
+
+def test_without_sheets_no_poller_is_started(store):
+    hub = LiveSyncHub(store, None)
+    hub.subscribe("c1")
+    assert hub._thread is None
+
+
+def test_poller_retries_until_the_index_can_be_opened(store, ws):
+    index = SheetHistoryIndex(ws, min_refresh_interval=0)
+    failures = [RuntimeError("429 quota exceeded")] * 2
+
+    def get_index():
+        if failures:
+            raise failures.pop()
+        return index
+
+    hub = LiveSyncHub(store, get_index, interval=0.01, max_backoff=0.02)
+    try:
+        hub.subscribe("c1")
+        deadline = time.monotonic() + 5
+        while hub.imported < 2:
+            assert time.monotonic() < deadline, hub.last_error
+            time.sleep(0.01)
+    finally:
+        hub.close()
+    assert not failures
+    assert hub.last_error is None
+    assert len(store.history("c1")) == 2
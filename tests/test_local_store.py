@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""ChatLogStore"""
+import pytest
+
+from local_store import LOG_COLUMNS, ChatLogStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatLogStore(str(tmp_path / "chat_logs.sqlite3"))
+
+
+def _row(ts, cid="c1", role="user", content="msg"):
+    return [f"2026-01-01T00:00:{ts:02d}", cid, "bot", role, "name", content]
+
+
+def test_append_is_unsynced_until_marked(store):
+    first = store.append(_row(1))
+    second = store.append(_row(2))
+    assert [row_id for row_id, _ in store.unsynced()] == [first, second]
+    assert store.unsynced(limit=1) == [(first, _row(1))]
+
+    store.mark_synced([first, None])
+    assert store.unsynced() == [(second, _row(2))]
+    assert store.count() == 2 and store.count(unsynced_only=True) == 1
+
+
+def test_rows_accept_lists_and_dicts(store):
+    store.append(["2026-01-01T00:00:01", "c1", "bot", "user", None])
+    store.import_rows([{"timestamp": "2026-01-01T00:00:02", "conversation_id": "c1", "content": "x", "extra": "?"}])
+    assert store.history("c1") == [
+        dict(zip(LOG_COLUMNS, ["2026-01-01T00:00:01", "c1", "bot", "user", "", ""])),
+        dict(zip(LOG_COLUMNS, ["2026-01-01T00:00:02", "c1", "", "", "", "x"])),
+    ]
+
+
+def test_import_ignores_known_rows_and_rows_without_conversation(store):
+    store.append(_row(1))
+    assert store.import_rows([_row(1), _row(2), _row(3, cid="")]) == 1
+    assert store.import_rows([_row(2)]) == 0
+    assert store.count() == 2
+    assert store.count(unsynced_only=True) == 1  # 取り込んだ行は同期済み
+
+
+def test_history_is_in_time_order(store):
+    store.append(_row(5, content="later"))
+    store.import_rows([_row(1, content="earlier")])
+    store.append(_row(3, cid="c2"))
+    assert [r["content"] for r in store.history("c1")] == ["earlier", "later"]
+
+
+def test_rows_after_and_last_id(store):
+    a = store.append(_row(1))
+    store.append(_row(1, cid="c2"))
+    b = store.append(_row(2, role="assistant"))
+    assert store.last_id("c1") == b
+    assert store.last_id("missing") == 0
+    assert [row_id for row_id, _ in store.rows_after("c1")] == [a, b]
+    assert store.rows_after("c1", a) == [(b, dict(zip(LOG_COLUMNS, _row(2, role="assistant"))))]
+
+
+def test_meta(store):
+    assert store.get_meta("k", 1) == 1
+    store.set_meta("k", 10)
+    store.set_meta("k", 12)
+    assert store.get_meta("k") == "12"
+
+
+def test_stores_share_the_file(store):
+    other = ChatLogStore(store.path)
+    store.append(_row(1))
+    assert len(other.history("c1")) == 1
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""SheetLogWriter（bench/fake_sheets.py の FakeWorksheet 相手）"""
+import pytest
+
+from bench.fake_sheets import FakeAPIError, FakeWorksheet
+from log_writer import SheetLogWriter
+
+
+class FlakyWorksheet(FakeWorksheet):
+    """append_rows の最初の failures 回は error を送出する"""
+
+    def __init__(self, failures, error):
+        super().__init__()
+        self.failures = failures
+        self.error = error
+        self.attempts = []
+
+    def append_rows(self, rows, value_input_option=None):
+        self.attempts.append(len(rows))
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        super().append_rows(rows, value_input_option)
+
+
+def _row(i):
+    return ["2026-01-01T00:00:00", "c1", "bot", "user", "name", f"msg{i}"]
+
+
+@pytest.fixture
+def make_writer():
+    writers = []
+
+    def make(ws, **kwargs):
+        kwargs.setdefault("flush_interval", 0.01)
+        kwargs.setdefault("max_backoff", 0.01)
+        writer = SheetLogWriter(ws, **kwargs)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        writer.close()
+
+
+def test_rows_are_written_in_batches(make_writer):
+    ws = FakeWorksheet()
+    written = []
+    writer = make_writer(ws, batch_size=2, flush_interval=0.5, on_written=written.extend)
+    for i in range(5):
+        writer.enqueue(_row(i), key=i)
+    assert writer.flush(5)
+
+    assert [r[-1] for r in ws._rows[1:]] == [f"msg{i}" for i in range(5)]
+    assert written == [0, 1, 2, 3, 4]
+    assert writer.written == 5 and writer.dropped == 0
+    assert writer.queue_depth == 0
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_retryable_errors_keep_rows_until_written(make_writer, status):
+    ws = FlakyWorksheet(failures=3, error=FakeAPIError(status))
+    written = []
+    writer = make_writer(ws, on_written=written.extend)
+    writer.enqueue(_row(0), key="a")
+    writer.enqueue(_row(1), key="b")
+    assert writer.flush(5)
+
+    assert len(ws.attempts) == 4
+    assert ws.row_count == 3
+    assert written == ["a", "b"]
+    assert writer.dropped == 0 and writer.last_error is None
+
+
+def test_other_errors_drop_the_batch(make_writer):
+    ws = FlakyWorksheet(failures=1, error=FakeAPIError(400))
+    written = []
+    writer = make_writer(ws, on_written=written.extend)
+    writer.enqueue(_row(0), key="a")
+    assert writer.flush(5)
+    assert writer.dropped == 1 and writer.written == 0
+    assert isinstance(writer.last_error, FakeAPIError)
+    assert ws.row_count == 1
+
+    writer.enqueue(_row(1), key="b")
+    assert writer.flush(5)
+    assert written == ["b"]
+    assert writer.last_error is None
+
+
+def test_on_written_failure_is_recorded_without_losing_rows(make_writer):
+    ws = FakeWorksheet()
+
+    def on_written(keys):
+        raise RuntimeError("sqlite locked")
+
+    writer = make_writer(ws, on_written=on_written)
+    writer.enqueue(_row(0), key="a")
+    assert writer.flush(5)
+    assert ws.row_count == 2
+    assert isinstance(writer.last_error, RuntimeError)
+
+
+def test_close_writes_remaining_rows():
+    ws = FakeWorksheet()
+    writer = SheetLogWriter(ws, batch_size=100, flush_interval=60)
+    for i in range(3):
+        writer.enqueue(_row(i))
+    writer.close()
+    assert ws.row_count == 4
+    assert writer.written == 3
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""TokenBucket / Governor"""
+import threading
+import time
+
+import pytest
+
+import rate_limit
+from rate_limit import Governor, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit.time, "monotonic", clock)
+    return clock
+
+
+def test_token_bucket_burst_then_refill(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+
+    clock.now += 0.25
+    assert bucket.try_acquire() == pytest.approx(0.25)
+    clock.now += 0.25
+    assert bucket.try_acquire() == 0.0
+
+
+def test_token_bucket_does_not_exceed_burst(clock):
+    bucket = TokenBucket(rate=10.0, burst=2)
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.try_acquire() > 0
+
+
+def test_token_bucket_acquire_timeout():
+    bucket = TokenBucket(rate=0.5, burst=1)
+    assert bucket.acquire(timeout=0)
+    started = time.monotonic()
+    assert not bucket.acquire(timeout=0.05)
+    assert time.monotonic() - started < 1.0
+
+
+def _wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_governor_limits_concurrency():
+    governor = Governor(rate=1000, burst=1000, max_concurrent=2, poll_interval=0.01)
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def work():
+        with governor.slot():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert peak[0] == 2
+    assert governor.active == 0 and governor.waiting == 0
+
+
+def test_governor_is_first_come_first_served_and_reports_position():
+    governor = Governor(rate=1000, burst=1000, max_concurrent=1, poll_interval=0.01)
+    order, positions = [], {}
+
+    def work(i):
+        seen = positions.setdefault(i, [])
+        with governor.slot(on_wait=seen.append):
+            order.append(i)
+
+    with governor.slot():
+        threads = []
+        for i in range(4):
+            t = threading.Thread(target=work, args=(i,))
+            t.start()
+            threads.append(t)
+            _wait_until(lambda: governor.waiting == i + 1)
+    for t in threads:
+        t.join()
+
+    assert order == [0, 1, 2, 3]
+    assert positions[0] == [1]
+    assert positions[3][0] == 4 and positions[3] == sorted(positions[3], reverse=True)
+
+
+def test_governor_rate_limits_entries():
+    governor = Governor(rate=20, burst=1, max_concurrent=4, poll_interval=0.01)
+    started = time.monotonic()
+    for _ in range(4):
+        governor.call(lambda: None)
+    assert time.monotonic() - started >= 0.14  # 2件目以降は 1/20 秒ずつ待つ
+
+
+def test_governor_drops_ticket_when_waiter_fails():
+    governor = Governor(rate=1000, burst=1000, max_concurrent=1, poll_interval=0.01)
+
+    def on_wait(pos):
+        raise KeyboardInterrupt  # 待っている間のセッション終了など
+
+    with governor.slot():
+        with pytest.raises(KeyboardInterrupt):
+            with governor.slot(on_wait=on_wait):
+                pass
+        assert governor.waiting == 0
+    assert governor.call(lambda: "ok") == "ok"
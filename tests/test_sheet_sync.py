@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""SheetSynchronizer（bench/fake_sheets.py の FakeWorksheet 相手）"""
+import pytest
+
+from bench.fake_sheets import FakeAPIError, FakeWorksheet
+from local_store import ChatLogStore
+from sheet_sync import SheetSynchronizer
+
+
+class RecordingWorksheet(FakeWorksheet):
+    """get() で読んだ範囲を記録する"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.ranges = []
+
+    def get(self, a1):
+        self.ranges.append(a1)
+        return super().get(a1)
+
+
+def _row(i, cid="c1"):
+    return [f"2026-01-01T00:{i // 60:02d}:{i % 60:02d}", cid, "bot", "user", "name", f"msg{i}"]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatLogStore(str(tmp_path / "chat_logs.sqlite3"))
+
+
+@pytest.fixture
+def start():
+    syncs = []
+
+    def start(store, ws, **kwargs):
+        sync = SheetSynchronizer(store, ws, **kwargs)
+        syncs.append(sync)
+        if kwargs.get("backfill", True):
+            assert sync.backfill_done.wait(5)
+        return sync
+
+    yield start
+    for sync in syncs:
+        sync.writer.close()
+
+
+def test_backfill_imports_sheet_rows_in_chunks(store, start):
+    ws = RecordingWorksheet()
+    ws.preload([_row(i) for i in range(7)])
+    sync = start(store, ws, backfill_chunk=3)
+
+    assert sync.backfill_error is None
+    assert sync.backfilled == 7
+    assert ws.ranges == ["A2:F4", "A5:F7", "A8:F10"]
+    assert store.get_meta(SheetSynchronizer.META_LAST_ROW) == "8"
+    assert [r["content"] for r in store.history("c1")] == [f"msg{i}" for i in range(7)]
+    assert store.count(unsynced_only=True) == 0
+
+
+def test_next_start_reads_only_rows_after_the_watermark(store, start):
+    ws = RecordingWorksheet()
+    ws.preload([_row(i) for i in range(4)])
+    start(store, ws, backfill_chunk=100)
+
+    ws.preload([_row(i) for i in range(4, 6)])
+    ws.ranges.clear()
+    sync = start(store, ws, backfill_chunk=100)  # 次のプロセス
+
+    assert ws.ranges == ["A6:F105"]
+    assert sync.backfilled == 2
+    assert store.get_meta(SheetSynchronizer.META_LAST_ROW) == "7"
+    assert store.count() == 6
+
+
+def test_backfill_skips_rows_already_in_the_local_store(store, start):
+    store.import_rows([_row(0)])
+    ws = FakeWorksheet()
+    ws.preload([_row(0), _row(1), ["", "", "", "", "", ""], _row(2, cid="c2")])
+    sync = start(store, ws)
+
+    assert sync.backfilled == 2
+    assert store.count() == 3
+    assert store.get_meta(SheetSynchronizer.META_LAST_ROW) == "5"
+
+
+def test_backfill_error_is_reported_and_keeps_the_watermark(store, start):
+    ws = FakeWorksheet(error_every=2)  # row_values は成功し、最初の get が 429
+    ws.preload([_row(0)])
+    sync = start(store, ws)
+
+    assert isinstance(sync.backfill_error, FakeAPIError)
+    assert sync.last_error is sync.backfill_error
+    assert store.get_meta(SheetSynchronizer.META_LAST_ROW) is None
+
+
+def test_without_backfill_nothing_is_imported(store, start):
+    ws = FakeWorksheet()
+    ws.preload([_row(0)])
+    sync = start(store, ws, backfill=False)
+
+    assert not sync.backfill_done.wait(0.2)
+    assert store.count() == 0
+
+
+def test_unsynced_rows_are_resent_on_start_and_mirror_marks_synced(store, start):
+    store.append(_row(0))  # 前回のプロセスでシートに書けなかった行
+    ws = FakeWorksheet()
+    sync = start(store, ws, backfill=False)
+    sync._thread.join(5)  # 起動時の再送の予約を待つ
+    assert sync.writer.flush(5)
+    assert ws.row_count == 2
+    assert store.unsynced() == []
+
+    row_id = store.append(_row(1))
+    sync.mirror(row_id, _row(1))
+    assert sync.writer.flush(5)
+    assert ws.row_count == 3
+    assert store.unsynced() == []
+    assert sync.queue_depth == 0
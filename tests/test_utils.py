@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""CSV 書き出し（キーワード分割形式 / 通常形式）"""
+import codecs
+import csv
+import io
+
+import pandas as pd
+
+from utils import IncrementalMessagesCsv, keyword_split_csv_file, prepare_keyword_split_csv
+
+
+def _rows(data: bytes):
+    assert data.startswith(codecs.BOM_UTF8)
+    return list(csv.reader(io.StringIO(data.decode("utf-8-sig"))))
+
+
+def test_keyword_split_truncates_and_annotates_last_keyword():
+    messages = [
+        {"role": "user", "content": "質問", "name": "alice"},
+        {"role": "assistant", "content": "\n".join(f"kw{i}" for i in range(1, 8)), "name": "bot"},
+        {"role": "assistant", "content": "a\n\n  b  \n", "name": "bot"},
+    ]
+    header, user, long_answer, short_answer = _rows(prepare_keyword_split_csv(messages, max_keywords=3))
+
+    assert header == ["role", "name", "content", "keyword_1", "keyword_2", "keyword_3"]
+    assert user[:3] == ["user", "alice", "質問"] and user[3:] == ["", "", ""]
+    assert long_answer[3:] == ["kw1", "kw2", "kw3 (...+4 truncated)"]
+    assert short_answer[3:] == ["a", "b", ""]  # 空行は飛ばし、前後の空白は除く
+
+
+def test_keyword_split_columns_shrink_to_longest_answer():
+    messages = [{"role": "assistant", "content": "x\ny", "name": "bot"}]
+    header, row = _rows(prepare_keyword_split_csv(messages, max_keywords=150))
+    assert header[3:] == ["keyword_1", "keyword_2"]
+    assert row[3:] == ["x", "y"]
+
+
+def test_keyword_split_exactly_at_limit_is_not_annotated():
+    messages = [{"role": "assistant", "content": "a\nb\nc", "name": "bot"}]
+    _, row = _rows(prepare_keyword_split_csv(messages, max_keywords=3))
+    assert row[3:] == ["a", "b", "c"]
+
+
+def test_keyword_split_file_matches_bytes():
+    messages = [{"role": "assistant", "content": f"kw{i}\nkw{i + 1}", "name": "bot"} for i in range(1200)]
+    with keyword_split_csv_file(messages, max_keywords=1, max_memory=1024) as f:
+        assert f.read() == prepare_keyword_split_csv(messages, max_keywords=1)
+
+
+def _old_plain_csv(messages):
+    """変更前の書き出し（pandas.DataFrame.to_csv）"""
+    return pd.DataFrame(messages).to_csv(index=False).encode("utf-8-sig")
+
+
+MESSAGES = [
+    {"role": "user", "content": "こんにちは", "name": "alice"},
+    {"role": "assistant", "content": "kw1\nkw2\n「引用」, \"quote\"", "name": "①ペルソナ"},
+    {"role": "user", "content": " 前後の空白 ", "name": "bob,carol"},
+    {"role": "assistant", "content": "", "name": "①ペルソナ"},
+    {"role": "user", "content": "line1\r\nline2", "name": ""},
+]
+
+
+def test_incremental_csv_matches_to_csv_as_messages_grow():
+    exporter = IncrementalMessagesCsv()
+    messages = []
+    assert exporter.update(messages) == "role,content,name\n".encode("utf-8-sig")
+    for m in MESSAGES:
+        messages.append(m)
+        assert exporter.update(messages) == _old_plain_csv(messages)
+
+
+def test_incremental_csv_resets_when_list_is_replaced():
+    exporter = IncrementalMessagesCsv()
+    exporter.update(list(MESSAGES))
+
+    shorter = [dict(m) for m in MESSAGES[:2]]
+    assert exporter.update(shorter) == _old_plain_csv(shorter)
+
+    # 同じ長さでも別の会話に差し替わった場合
+    replaced = [dict(m, content=m["content"] + "!") for m in MESSAGES[:2]]
+    assert exporter.update(replaced) == _old_plain_csv(replaced)
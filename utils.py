@@ -1,5 +1,89 @@
+import codecs
+import csv
 import io
-import pandas as pd
+import tempfile
+import threading
+
+BASE_COLUMNS = ["role", "name", "content"]
+PLAIN_COLUMNS = ["role", "content", "name"]
+
+
+def _split_keywords(content):
+    """Split assistant content into non-empty, stripped lines."""
+    return [k.strip() for k in str(content).splitlines() if k.strip()]
+
+
+def _truncate_keywords(kws, max_keywords):
+    """Keep at most max_keywords and annotate the last one with the number dropped."""
+    if len(kws) > max_keywords:
+        remaining = len(kws) - max_keywords
+        kws = kws[:max_keywords]
+        if kws:
+            kws[-1] = f"{kws[-1]} (...+{remaining} truncated)"
+    return kws
+
+
+def count_keyword_columns(messages, max_keywords=100000):
+    """First pass: number of keyword_N columns needed (capped at max_keywords)."""
+    max_kw = 0
+    for m in messages:
+        if m.get("role", "") == "assistant":
+            n = sum(1 for k in str(m.get("content", "")).splitlines() if k.strip())
+            max_kw = max(max_kw, min(n, max_keywords))
+    return max_kw
+
+
+def iter_keyword_split_rows(messages, max_keywords=100000, extra_columns=()):
+    """Yield the header and then one list per message:
+    role, name, content, *extra_columns, keyword_1..keyword_N.
+
+    messages is iterated twice (column count, then rows), so pass a sequence.
+    """
+    max_kw = count_keyword_columns(messages, max_keywords)
+    extra_columns = list(extra_columns)
+    yield BASE_COLUMNS + extra_columns + [f"keyword_{i+1}" for i in range(max_kw)]
+
+    for m in messages:
+        role = m.get("role", "")
+        content = m.get("content", "")
+        kws = _truncate_keywords(_split_keywords(content), max_keywords) if role == "assistant" else []
+        yield ([role, m.get("name", ""), content]
+               + [m.get(c, "") for c in extra_columns]
+               + kws + [""] * (max_kw - len(kws)))
+
+
+def iter_keyword_split_csv(messages, max_keywords=100000, chunk_rows=500, extra_columns=()):
+    """messages: sequence of dicts with keys role, content, name
+
+    Same layout as prepare_keyword_split_csv, but yields the CSV as utf-8-sig
+    encoded byte chunks of about chunk_rows rows. Only one chunk is held in
+    memory at a time. extra_columns are copied from each message after content.
+    """
+    encoder = codecs.getincrementalencoder("utf-8-sig")()
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+
+    pending = 0
+    for row in iter_keyword_split_rows(messages, max_keywords, extra_columns):
+        writer.writerow(row)
+        pending += 1
+        if pending >= chunk_rows:
+            yield encoder.encode(buf.getvalue())
+            buf.seek(0)
+            buf.truncate()
+            pending = 0
+
+    yield encoder.encode(buf.getvalue(), final=True)
+
+
+def keyword_split_csv_file(messages, max_keywords=100000, max_memory=8 * 1024 * 1024):
+    """Write the keyword-split CSV into a spooled temp file (kept in memory up to
+    max_memory bytes, then on disk) and return it rewound, ready for st.download_button."""
+    f = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    for chunk in iter_keyword_split_csv(messages, max_keywords):
+        f.write(chunk)
+    f.seek(0)
+    return f
 
 
 def prepare_keyword_split_csv(messages, max_keywords=100000):
@@ -10,38 +94,45 @@ def prepare_keyword_split_csv(messages, max_keywords=100000):
     - Truncate to max_keywords and annotate the last keyword with truncation info if truncated
     Returns: bytes (utf-8-sig)
     """
-    rows = []
-    max_kw = 0
-    for m in messages:
-        role = m.get("role", "")
-        name = m.get("name", "")
-        content = m.get("content", "")
-        if role == "assistant":
-            kws = [k.strip() for k in str(content).splitlines() if k.strip()]
-            #if len(kws) > max_keywords:
-            #    remaining = len(kws) - max_keywords
-            #    kws = kws[:max_keywords]
-            #    if kws:
-            #        kws[-1] = f"{kws[-1]} (...+{remaining} truncated)"
-        else:
-            kws = []
-        rows.append({"role": role, "name": name, "content": content, "_kws": kws})
-        if len(kws) > max_kw:
-            max_kw = len(kws)
-
-    out_rows = []
-    for r in rows:
-        out = {"role": r["role"], "name": r["name"], "content": r["content"]}
-        for i in range(max_kw):
-            out[f"keyword_{i+1}"] = r["_kws"][i] if i < len(r["_kws"]) else ""
-        out_rows.append(out)
-
-    df_out = pd.DataFrame(out_rows)
-    buf = io.StringIO()
-    df_out.to_csv(buf, index=False)
+    return b"".join(iter_keyword_split_csv(messages, max_keywords))
+
 
-    return buf.getvalue().encode("utf-8-sig")
+class IncrementalMessagesCsv:
+    """Plain (role, content, name) CSV of a growing message list.
+
+    update() only encodes the messages appended since the previous call and
+    keeps the encoded rows, so repeated exports of a long chat cost O(new rows).
+    If the list was replaced or shortened (new conversation, history reload),
+    it is re-encoded from scratch. Thread-safe, so it can back a deferred
+    st.download_button callable.
+    """
 
+    def __init__(self, columns=PLAIN_COLUMNS):
+        self.columns = list(columns)
+        self._lock = threading.Lock()
+        self._reset()
 
+    def _reset(self):
+        self._parts = [self._encode_rows([self.columns])]
+        self._count = 0
+        self._last = None  # the last encoded message object, to detect a replaced list
 
+    def _encode_rows(self, rows):
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerows(rows)
+        return buf.getvalue().encode("utf-8")
 
+    def update(self, messages):
+        """Encode messages[count:] and return the whole CSV as utf-8-sig bytes."""
+        with self._lock:
+            if len(messages) < self._count or (self._count and messages[self._count - 1] is not self._last):
+                self._reset()
+            new = messages[self._count:]
+            if new:
+                self._parts.append(self._encode_rows(
+                    [["" if m.get(c) is None else m.get(c) for c in self.columns] for m in new]
+                ))
+                self._count = len(messages)
+                self._last = messages[-1]
+            return codecs.BOM_UTF8 + b"".join(self._parts)